@@ -1,12 +1,157 @@
-import gradio as gr
-import ollama
+import time
+_MODULE_START = time.perf_counter()
+
+import asyncio
+import importlib
+import weakref
 import json
-import requests
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import sqlite3
+import zlib
+import re
+from bisect import bisect_left
 from pathlib import Path
 import os
-import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from datetime import datetime, timedelta
 
+class LazyModule:
+    """Module proxy that defers the real import until an attribute is first used"""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Heavy third-party modules are imported on first use to keep startup fast
+gr = LazyModule("gradio")
+ollama = LazyModule("ollama")
+np = LazyModule("numpy")
+requests = LazyModule("requests")
+httpx = LazyModule("httpx")
+
+# Build the UI with empty lists and fill them in from a load event once the server is up
+DEFERRED_STARTUP = os.environ.get("LOCALGPT_DEFERRED_STARTUP", "1") == "1"
+# Optional JSON-lines file that startup timings are appended to
+STARTUP_LOG = os.environ.get("LOCALGPT_STARTUP_LOG")
+
+# Seconds spent in each startup phase (import, gradio_import, ui_build, launch, first_paint)
+startup_timings = {}
+
+# Streaming configuration: minimum seconds between Chatbot refreshes while tokens arrive
+STREAM_UPDATE_INTERVAL = float(os.environ.get("LOCALGPT_STREAM_UPDATE_INTERVAL", "0.1"))
+
+# Inference metrics: samples kept per model for percentiles, and the local
+# Prometheus endpoint (port 0 disables it)
+METRICS_SAMPLES_PER_MODEL = int(os.environ.get("LOCALGPT_METRICS_SAMPLES", "1000"))
+METRICS_PORT = int(os.environ.get("LOCALGPT_METRICS_PORT", "9464"))
+
+# Retrieval configuration for document mode
+EMBEDDING_MODEL = os.environ.get("LOCALGPT_EMBEDDING_MODEL", "nomic-embed-text")
+CHUNK_SIZE = int(os.environ.get("LOCALGPT_CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.environ.get("LOCALGPT_CHUNK_OVERLAP", "200"))
+RETRIEVAL_TOP_K = int(os.environ.get("LOCALGPT_RETRIEVAL_TOP_K", "4"))
+EMBEDDING_BATCH_SIZE = 64
+
+# On-disk embedding store shared by all sessions and projects
+EMBEDDING_STORE_DIR = os.environ.get("LOCALGPT_EMBEDDING_STORE_DIR", "embeddings")
+EMBEDDING_STORE_BUDGET_MB = int(os.environ.get("LOCALGPT_EMBEDDING_STORE_BUDGET_MB", "1024"))
+
+# Context window budgeting policy
+DEFAULT_CONTEXT_LENGTH = int(os.environ.get("LOCALGPT_DEFAULT_NUM_CTX", "2048"))
+MAX_CONTEXT_LENGTH = int(os.environ.get("LOCALGPT_MAX_NUM_CTX", "8192"))
+REPLY_TOKEN_RESERVE = int(os.environ.get("LOCALGPT_REPLY_TOKEN_RESERVE", "1024"))
+DOCUMENT_SHARE_CAP = float(os.environ.get("LOCALGPT_DOCUMENT_SHARE_CAP", "0.5"))
+CHARS_PER_TOKEN = 4
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# Opt-in compaction of long conversations: older turns are replaced by a rolling summary
+COMPACTION_DEFAULT = os.environ.get("LOCALGPT_COMPACTION", "0") == "1"
+COMPACTION_KEEP_TURNS = int(os.environ.get("LOCALGPT_COMPACTION_KEEP_TURNS", "6"))
+COMPACTION_BATCH_TURNS = int(os.environ.get("LOCALGPT_COMPACTION_BATCH_TURNS", "4"))
+# Model used to write summaries (defaults to the chat model)
+SUMMARY_MODEL = os.environ.get("LOCALGPT_SUMMARY_MODEL", "")
+SUMMARY_MAX_TOKENS = int(os.environ.get("LOCALGPT_SUMMARY_MAX_TOKENS", "512"))
+
+# How long Ollama keeps a model (and its prompt cache) loaded after a request
+KEEP_ALIVE = os.environ.get("LOCALGPT_KEEP_ALIVE", "30m")
+# Warm the model's prompt cache with the document as soon as it is uploaded
+PREFILL_ON_UPLOAD = os.environ.get("LOCALGPT_PREFILL_ON_UPLOAD", "1") == "1"
+
+# Document extraction limits and parallelism
+MAX_UPLOAD_MB = float(os.environ.get("LOCALGPT_MAX_UPLOAD_MB", "100"))
+MAX_PDF_PAGES = int(os.environ.get("LOCALGPT_MAX_PDF_PAGES", "2000"))
+EXTRACTION_WORKERS = int(os.environ.get("LOCALGPT_EXTRACTION_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+PDF_PAGES_PER_TASK = 16
+PARALLEL_PDF_MIN_PAGES = 32
+
+# On-disk cache of extracted document text, keyed by file hash
+EXTRACTION_CACHE_DIR = os.environ.get("LOCALGPT_EXTRACTION_CACHE_DIR", "extraction_cache")
+EXTRACTION_CACHE_BUDGET_MB = int(os.environ.get("LOCALGPT_EXTRACTION_CACHE_BUDGET_MB", "512"))
+# Bump whenever extraction output changes so stale cache entries are ignored
+EXTRACTOR_VERSION = "1"
+
+# SQLite database holding saved chat projects
+PROJECTS_DIR = "projects"
+PROJECTS_DB = os.environ.get("LOCALGPT_PROJECTS_DB", os.path.join(PROJECTS_DIR, "projects.db"))
+
+# Ollama connection settings shared by the sync and async clients
+OLLAMA_HOST = os.environ.get("LOCALGPT_OLLAMA_HOST") or os.environ.get("OLLAMA_HOST")
+OLLAMA_TIMEOUT = float(os.environ.get("LOCALGPT_OLLAMA_TIMEOUT", "300"))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("LOCALGPT_OLLAMA_CONNECT_TIMEOUT", "10"))
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("LOCALGPT_OLLAMA_MAX_CONNECTIONS", "64"))
+OLLAMA_MAX_KEEPALIVE = int(os.environ.get("LOCALGPT_OLLAMA_MAX_KEEPALIVE", "16"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.environ.get("LOCALGPT_OLLAMA_KEEPALIVE_EXPIRY", "30"))
+# Comma-separated list of Ollama endpoints to balance across (defaults to OLLAMA_HOST)
+OLLAMA_HOSTS = [
+    host.strip() for host in os.environ.get("LOCALGPT_OLLAMA_HOSTS", "").split(",") if host.strip()
+] or [OLLAMA_HOST]
+BACKEND_PROBE_INTERVAL = float(os.environ.get("LOCALGPT_BACKEND_PROBE_INTERVAL", "15"))
+# Memory budget per Ollama host for resident models; 0 disables eviction
+MODEL_RAM_BUDGET_GB = float(os.environ.get("LOCALGPT_MODEL_RAM_BUDGET_GB", "0"))
+# Load the selected model in the background as soon as the dropdown changes
+PRELOAD_ON_SELECT = os.environ.get("LOCALGPT_PRELOAD_ON_SELECT", "1") == "1"
+
+# Admission control in front of Ollama
+MODEL_CONCURRENCY = int(os.environ.get("LOCALGPT_MODEL_CONCURRENCY", "1"))
+PULL_CONCURRENCY = int(os.environ.get("LOCALGPT_PULL_CONCURRENCY", "1"))
+MAX_QUEUED_PER_SESSION = int(os.environ.get("LOCALGPT_MAX_QUEUED_PER_SESSION", "4"))
+QUEUE_POLL_INTERVAL = 0.5
+# Gradio worker settings; concurrency should exceed MODEL_CONCURRENCY so waiting
+# happens in the fair scheduler (which reports queue positions) rather than Gradio
+GRADIO_CONCURRENCY = int(os.environ.get("LOCALGPT_GRADIO_CONCURRENCY", "16"))
+GRADIO_MAX_QUEUE = int(os.environ.get("LOCALGPT_GRADIO_MAX_QUEUE", "64"))
+
+# Background model downloads: job list persisted across restarts, UI refresh period
+DOWNLOADS_FILE = os.environ.get("LOCALGPT_DOWNLOADS_FILE", "downloads.json")
+DOWNLOAD_UI_INTERVAL = float(os.environ.get("LOCALGPT_DOWNLOAD_UI_INTERVAL", "1"))
+
+# Opt-in cache of replies for deterministic generation settings
+RESPONSE_CACHE_DIR = os.environ.get("LOCALGPT_RESPONSE_CACHE_DIR", "response_cache")
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.environ.get("LOCALGPT_RESPONSE_CACHE_MEMORY_ENTRIES", "256"))
+RESPONSE_CACHE_BUDGET_MB = int(os.environ.get("LOCALGPT_RESPONSE_CACHE_BUDGET_MB", "64"))
+
+# Model catalog caching (seconds before a cached list is considered stale)
+INSTALLED_MODELS_TTL = float(os.environ.get("LOCALGPT_INSTALLED_MODELS_TTL", "30"))
+REMOTE_MODELS_TTL = float(os.environ.get("LOCALGPT_REMOTE_MODELS_TTL", "3600"))
+MODEL_CATALOG_SNAPSHOT = os.environ.get("LOCALGPT_MODEL_CATALOG_SNAPSHOT", "model_catalog.json")
+# Seconds before a failed catalog fetch is retried (meanwhile the fallback list is served)
+MODEL_CATALOG_RETRY_TTL = float(os.environ.get("LOCALGPT_MODEL_CATALOG_RETRY_TTL", "30"))
+# Seconds to wait after a keystroke before searching the catalog
+MODEL_SEARCH_DEBOUNCE = float(os.environ.get("LOCALGPT_MODEL_SEARCH_DEBOUNCE", "0.2"))
+# Same for full-text search across saved projects, and how many projects it returns
+PROJECT_SEARCH_DEBOUNCE = float(os.environ.get("LOCALGPT_PROJECT_SEARCH_DEBOUNCE", "0.2"))
+PROJECT_SEARCH_LIMIT = int(os.environ.get("LOCALGPT_PROJECT_SEARCH_LIMIT", "20"))
+
 # Load and save project configurations
 def load_projects():
     if os.path.exists('projects.json'):
@@ -37,13 +182,438 @@ def load_models_config():
             "new": {}
         }
 
+def ollama_client_options(host=OLLAMA_HOST):
+    """Host, timeout and connection-pool settings for Ollama clients"""
+    return {
+        "host": host,
+        "timeout": httpx.Timeout(OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+        "limits": httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+            keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY
+        )
+    }
+
+_ollama_clients = {}
+_ollama_client_lock = threading.Lock()
+# httpx async pools belong to one event loop, so keep one set of clients per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_ollama_client(host=OLLAMA_HOST):
+    """Shared synchronous Ollama client for a host, for background threads and cached lookups"""
+    with _ollama_client_lock:
+        client = _ollama_clients.get(host)
+        if client is None:
+            client = ollama.Client(**ollama_client_options(host))
+            _ollama_clients[host] = client
+        return client
+
+def get_async_client(host=OLLAMA_HOST):
+    """Shared pooled ollama.AsyncClient for a host on the running event loop"""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(host)
+    if client is None:
+        client = ollama.AsyncClient(**ollama_client_options(host))
+        clients[host] = client
+    return client
+
+def model_entry_name(model):
+    """Name of a model entry from ollama list/ps, across client versions"""
+    return model.get('name') or model.get('model')
+
+def is_connection_error(error):
+    """True for errors that mean the host is unreachable rather than the request being bad"""
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+class Backend:
+    """One Ollama endpoint and what the last probe learned about it"""
+    
+    def __init__(self, host):
+        self.host = host
+        self.healthy = True
+        self.latency = None
+        # Loaded model name -> resident size in bytes (0 if not yet known)
+        self.loaded = {}
+        self.installed = set()
+        self.outstanding = 0
+        self.last_error = ""
+        self.last_probe = 0.0
+    
+    @property
+    def label(self):
+        return self.host or "localhost:11434"
+
+class BackendPool:
+    """Routes Ollama requests across several hosts.
+
+    A background thread probes every host for health, latency, installed
+    models and currently loaded models. Requests for a model go first to
+    healthy hosts that already have it loaded, then to hosts that have it
+    installed, breaking ties by fewest outstanding requests and lower
+    latency. Connection errors mark a host unhealthy and callers fail over
+    to the next candidate.
+    """
+    
+    def __init__(self, hosts=OLLAMA_HOSTS, probe_interval=BACKEND_PROBE_INTERVAL):
+        self.backends = [Backend(host) for host in hosts]
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._started = False
+    
+    def probe(self, backend):
+        """Refresh one backend's health, latency and model lists"""
+        client = get_ollama_client(backend.host)
+        start_time = time.perf_counter()
+        try:
+            installed = {model_entry_name(model) for model in client.list()['models']}
+            latency = time.perf_counter() - start_time
+            loaded = {}
+            if hasattr(client, 'ps'):
+                loaded = {model_entry_name(model): model.get('size') or 0 for model in client.ps()['models']}
+        except Exception as e:
+            with self._lock:
+                backend.healthy = False
+                backend.last_error = str(e)
+                backend.last_probe = time.time()
+            return
+        with self._lock:
+            backend.healthy = True
+            backend.latency = latency
+            backend.installed = installed
+            backend.loaded = loaded
+            backend.last_error = ""
+            backend.last_probe = time.time()
+    
+    def probe_all(self):
+        for backend in self.backends:
+            self.probe(backend)
+    
+    def _probe_loop(self):
+        while True:
+            self.probe_all()
+            time.sleep(self.probe_interval)
+    
+    def start(self):
+        """Begin periodic health probes in a daemon thread"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._probe_loop, daemon=True).start()
+    
+    def candidates(self, model_name=None):
+        """Backends to try for a model, best first; unhealthy hosts go last.
+
+        A host that already has MODEL_CONCURRENCY requests in flight ranks
+        below any free host that can serve the model, even one that must
+        load it first, so traffic spreads out instead of piling onto the
+        one host that happens to have the model resident.
+        """
+        with self._lock:
+            def rank(backend):
+                return (
+                    not backend.healthy,
+                    bool(backend.installed) and model_name not in backend.installed,
+                    backend.outstanding >= MODEL_CONCURRENCY,
+                    model_name not in backend.loaded,
+                    backend.outstanding,
+                    backend.latency if backend.latency is not None else float('inf')
+                )
+            return sorted(self.backends, key=rank)
+    
+    def hosts_with(self, model_name):
+        with self._lock:
+            return [backend for backend in self.backends if model_name in backend.installed]
+    
+    @contextmanager
+    def track(self, backend):
+        """Count a request as outstanding on backend for the duration of the block"""
+        with self._lock:
+            backend.outstanding += 1
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                backend.outstanding -= 1
+    
+    def note_unloaded(self, backend, model_name):
+        with self._lock:
+            backend.loaded.pop(model_name, None)
+    
+    def mark_failed(self, backend, error):
+        with self._lock:
+            backend.healthy = False
+            backend.last_error = str(error)
+        print(f"Ollama host {backend.label} failed: {error}")
+    
+    def note_loaded(self, backend, model_name):
+        with self._lock:
+            backend.loaded.setdefault(model_name, 0)
+            backend.installed.add(model_name)
+    
+    def capacity(self, model_name):
+        """Number of healthy hosts able to serve the model (at least 1)"""
+        with self._lock:
+            count = sum(
+                1 for backend in self.backends
+                if backend.healthy and (not backend.installed or model_name in backend.installed)
+            )
+        return max(1, count)
+    
+    def status_rows(self):
+        """Rows for the backends table in the Model Management tab"""
+        with self._lock:
+            return [
+                [
+                    backend.label,
+                    "✓ Healthy" if backend.healthy else f"✗ {backend.last_error or 'Unreachable'}",
+                    f"{backend.latency * 1000:.0f} ms" if backend.latency is not None else "—",
+                    backend.outstanding,
+                    ", ".join(
+                        f"{name} ({format_size(size)})" if size else name
+                        for name, size in sorted(backend.loaded.items())
+                    ) or "—",
+                    ", ".join(sorted(backend.installed)) or "—"
+                ]
+                for backend in self.backends
+            ]
+
+backend_pool = BackendPool()
+
+class ResidencyManager:
+    """Keeps the right models resident in Ollama's memory.
+
+    Remembers when each model was last used on each host. Before a model is
+    loaded, it asks the host which models are resident and how much memory
+    they take (ollama ps). If loading would exceed MODEL_RAM_BUDGET_GB, the
+    least recently used models are unloaded with keep_alive=0.
+    """
+    
+    def __init__(self, budget_gb=MODEL_RAM_BUDGET_GB):
+        self.budget_bytes = int(budget_gb * 1024 ** 3)
+        self._last_used = {}
+        self._lock = threading.Lock()
+    
+    def touch(self, host, model_name):
+        with self._lock:
+            self._last_used[(host, model_name)] = time.time()
+    
+    def _resident(self, client):
+        """Loaded models on a host as {name: size_in_bytes}"""
+        if not hasattr(client, 'ps'):
+            return {}
+        return {model_entry_name(model): model.get('size') or 0 for model in client.ps()['models']}
+    
+    def make_room(self, backend, model_name):
+        """Unload least recently used models on backend so model_name fits the budget"""
+        if not self.budget_bytes:
+            return
+        client = get_ollama_client(backend.host)
+        resident = self._resident(client)
+        if model_name in resident:
+            return
+        installed = get_installed_models().get(model_name) or {}
+        # The on-disk size is a reasonable lower bound for the memory a model needs
+        needed = installed.get("size") or 0
+        with self._lock:
+            by_age = sorted(resident, key=lambda name: self._last_used.get((backend.host, name), 0))
+        total = sum(resident.values())
+        for name in by_age:
+            if total + needed <= self.budget_bytes:
+                break
+            print(f"Unloading {name} from {backend.label} to free {format_size(resident[name])}")
+            client.generate(model=name, keep_alive=0)
+            backend_pool.note_unloaded(backend, name)
+            total -= resident[name]
+    
+    def warm(self, model_name):
+        """Load model_name on its preferred host, evicting others if needed"""
+        try:
+            start_time = time.perf_counter()
+            backend = backend_pool.candidates(model_name)[0]
+            if model_name in backend.loaded:
+                self.touch(backend.host, model_name)
+                return
+            # Load with the context size turns will use, or the first turn reloads the model
+            num_ctx = resolve_num_ctx(model_name)
+            with scheduled(model_name):
+                self.make_room(backend, model_name)
+                with backend_pool.track(backend):
+                    get_ollama_client(backend.host).generate(
+                        model=model_name, keep_alive=KEEP_ALIVE, options={"num_ctx": num_ctx}
+                    )
+            backend_pool.note_loaded(backend, model_name)
+            self.touch(backend.host, model_name)
+            print(f"Preloaded {model_name} on {backend.label} in {time.perf_counter() - start_time:.2f}s")
+        except Exception as e:
+            print(f"Error preloading {model_name}: {e}")
+
+residency_manager = ResidencyManager()
+
+def preload_selected_model(model_name):
+    """Start loading the newly selected model in the background"""
+    if not PRELOAD_ON_SELECT or not model_name:
+        return
+    threading.Thread(target=residency_manager.warm, args=(model_name,), daemon=True).start()
+
+def call_with_failover(model_name, request, loads_model=True):
+    """Run request(client) against the best backend for a model, failing over on connection errors"""
+    last_error = None
+    for backend in backend_pool.candidates(model_name):
+        try:
+            with backend_pool.track(backend):
+                result = request(get_ollama_client(backend.host))
+            if loads_model:
+                backend_pool.note_loaded(backend, model_name)
+                residency_manager.touch(backend.host, model_name)
+            return result
+        except Exception as e:
+            if not is_connection_error(e):
+                raise
+            backend_pool.mark_failed(backend, e)
+            last_error = e
+    raise last_error
+
+def fetch_installed_models():
+    """Query every Ollama host for installed models (uncached; raises if none respond)"""
+    installed = {}
+    reachable = False
+    last_error = None
+    for backend in backend_pool.backends:
+        try:
+            response = get_ollama_client(backend.host).list()
+        except Exception as e:
+            last_error = e
+            continue
+        reachable = True
+        for model in response['models']:
+            name = model_entry_name(model)
+            entry = installed.setdefault(name, {
+                "size": model.get('size'),
+                "digest": model.get('digest'),
+                "modified_at": str(model.get('modified_at') or ""),
+                "hosts": []
+            })
+            entry["hosts"].append(backend.label)
+    if not reachable:
+        raise last_error
+    return installed
+
+def fetch_remote_models():
+    """Query the Ollama library for extra model names (uncached; raises on failure)"""
+    response = requests.get('https://ollama.ai/api/tags', timeout=5)
+    response.raise_for_status()
+    return list(response.json())
+
+class ModelCatalog:
+    """TTL cache for the installed and remote model lists.
+
+    Fresh entries are served from memory. Stale entries are still served
+    immediately while a background thread refreshes them
+    (stale-while-revalidate). The last good lists are written to a snapshot
+    file so offline cold starts have something to show without waiting on
+    network timeouts. A failed fetch is cached too: its fallback (the last
+    good list, or an empty one) is served for MODEL_CATALOG_RETRY_TTL seconds
+    before the next attempt, so callers never wait out the same timeout twice
+    in a row.
+    """
+    
+    def __init__(self, snapshot_path=MODEL_CATALOG_SNAPSHOT):
+        self.snapshot_path = snapshot_path
+        self.fetchers = {"installed": fetch_installed_models, "remote": fetch_remote_models}
+        self.ttls = {"installed": INSTALLED_MODELS_TTL, "remote": REMOTE_MODELS_TTL}
+        self.defaults = {"installed": {}, "remote": []}
+        self._values = {}
+        self._fetched_at = {}
+        self._refreshing = set()
+        # Kinds whose cached value is a fallback left by a failed fetch
+        self._failed = set()
+        # Bumped whenever a cached list changes, so derived data knows to rebuild
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._load_snapshot()
+    
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            for kind, entry in snapshot.items():
+                if kind in self.fetchers:
+                    self._values[kind] = entry["value"]
+                    self._fetched_at[kind] = entry["fetched_at"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable model catalog snapshot: {e}")
+    
+    def _save_snapshot(self):
+        with self._lock:
+            snapshot = {
+                kind: {"value": value, "fetched_at": self._fetched_at[kind]}
+                for kind, value in self._values.items()
+                if kind not in self._failed
+            }
+        try:
+            with open(f"{self.snapshot_path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(f"{self.snapshot_path}.tmp", self.snapshot_path)
+        except Exception as e:
+            print(f"Couldn't write model catalog snapshot: {e}")
+    
+    def get(self, kind):
+        """Return the cached list, refreshing synchronously only if nothing is cached"""
+        with self._lock:
+            if kind in self._values:
+                value = self._values[kind]
+                stale = time.time() - self._fetched_at[kind] >= self.ttls[kind]
+                if stale and kind not in self._refreshing:
+                    self._refreshing.add(kind)
+                    threading.Thread(target=self._background_refresh, args=(kind,), daemon=True).start()
+                return value
+        return self.refresh(kind)
+    
+    def refresh(self, kind):
+        """Fetch a list now; on failure fall back to whatever is cached"""
+        try:
+            value = self.fetchers[kind]()
+        except Exception as e:
+            print(f"Error refreshing {kind} models: {e}")
+            with self._lock:
+                if kind not in self._values:
+                    self._values[kind] = self.defaults[kind]
+                    self._failed.add(kind)
+                # Treat the entry as fresh until the retry TTL runs out
+                self._fetched_at[kind] = time.time() - self.ttls[kind] + MODEL_CATALOG_RETRY_TTL
+                return self._values[kind]
+        with self._lock:
+            self._values[kind] = value
+            self._fetched_at[kind] = time.time()
+            self._failed.discard(kind)
+            self.generation += 1
+        self._save_snapshot()
+        return value
+    
+    def _background_refresh(self, kind):
+        try:
+            self.refresh(kind)
+        finally:
+            with self._lock:
+                self._refreshing.discard(kind)
+    
+    def invalidate(self, kind=None):
+        """Drop cached lists so the next get() fetches synchronously"""
+        with self._lock:
+            for name in ([kind] if kind else list(self._values)):
+                self._values.pop(name, None)
+                self._fetched_at.pop(name, None)
+                self._failed.discard(name)
+            self.generation += 1
+
+model_catalog = ModelCatalog()
+
 def get_installed_models():
-    try:
-        response = ollama.list()
-        return {model['name']: model for model in response['models']}
-    except Exception as e:
-        print(f"Error getting installed models: {e}")
-        return {}
+    return model_catalog.get("installed")
 
 def get_available_models():
     try:
@@ -70,17 +640,10 @@ def get_available_models():
             # Add more models as they become available
         }
         
-        # Try to get additional models from Ollama's API
-        try:
-            response = requests.get('https://ollama.ai/api/tags', timeout=5)
-            if response.status_code == 200:
-                api_models = response.json()
-                # Add any models from the API that aren't in our list
-                for model in api_models:
-                    if model not in models:
-                        models[model] = "Available through Ollama"
-        except Exception as e:
-            print(f"Couldn't fetch additional models from API: {e}")
+        # Add any models from Ollama's API that aren't in our list
+        for model in model_catalog.get("remote"):
+            if model not in models:
+                models[model] = "Available through Ollama"
         
         return models
     except Exception as e:
@@ -102,11 +665,14 @@ def fetch_available_models():
         for model_name, model_info in installed.items():
             base_name = model_name.split(':')[0]
             seen_models.add(base_name)
+            description = f"Installed model ({base_name})"
+            if len(backend_pool.backends) > 1 and model_info.get("hosts"):
+                description += f" on {', '.join(model_info['hosts'])}"
             model_list.append([
                 model_name,                    # Name
                 "Installed",                   # Category
                 "Local",                       # Size
-                f"Installed model ({base_name})",  # Description
+                description,                   # Description
                 "✓ Installed",                # Status
                 "Current",                     # Last Updated
                 "Remove"                       # Action
@@ -168,6 +734,8 @@ def fetch_available_models():
 
 def refresh_models():
     try:
+        # An explicit refresh always goes back to Ollama rather than the cache
+        model_catalog.invalidate()
         models = fetch_available_models()
         installed_count = sum(1 for m in models if '✓ Installed' in m[4])
         available_count = sum(1 for m in models if 'Not Installed' in m[4])
@@ -195,7 +763,411 @@ def refresh_models():
         )
         return error_msg, [], gr.Dropdown(choices=["All"], value="All")
 
-def chat_with_model(message, history, model_name, system_instruction=None):
+class QueueFullError(RuntimeError):
+    """Raised when a session already has the maximum number of queued requests"""
+
+class RequestTicket:
+    """One request waiting for (or holding) a slot on a model"""
+    
+    def __init__(self, key, session_id):
+        self.key = key
+        self.session_id = session_id
+        self.admitted = False
+        self.released = False
+        self.on_admit = None
+
+class RequestScheduler:
+    """Fair admission control for Ollama requests.
+
+    Each model (or the shared pull queue) has a concurrency limit. Waiting
+    requests are queued per user session, and free slots are handed out
+    round-robin across sessions so one busy user can't starve the others.
+    Each session may have at most MAX_QUEUED_PER_SESSION waiting requests per
+    model; further requests are rejected with QueueFullError. The app's own
+    work (prefill, preloads, summaries, downloads) queues under the shared
+    INTERNAL_SESSIONS, which are still scheduled fairly but never capped, so
+    it can't fail just because several users triggered it at once.
+    """
+    
+    PULL_KEY = "__pull__"
+    INTERNAL_SESSIONS = frozenset({"background", "summaries", "downloads"})
+    
+    def __init__(self, model_limit=MODEL_CONCURRENCY, pull_limit=PULL_CONCURRENCY,
+                 max_queued_per_session=MAX_QUEUED_PER_SESSION):
+        self.model_limit = model_limit
+        self.pull_limit = pull_limit
+        self.max_queued_per_session = max_queued_per_session
+        self._cond = threading.Condition()
+        self._active = defaultdict(int)
+        # key -> OrderedDict(session_id -> deque of tickets), in round-robin order
+        self._queues = defaultdict(OrderedDict)
+    
+    def _limit(self, key):
+        if key == self.PULL_KEY:
+            return self.pull_limit
+        # Every host that can serve the model adds its own set of slots
+        return self.model_limit * backend_pool.capacity(key)
+    
+    def enqueue(self, key, session_id):
+        """Queue a request and return its ticket (it may be admitted immediately)"""
+        with self._cond:
+            sessions = self._queues[key]
+            waiting = sessions.get(session_id)
+            if (waiting is not None and len(waiting) >= self.max_queued_per_session
+                    and session_id not in self.INTERNAL_SESSIONS):
+                raise QueueFullError(
+                    f"Too many queued requests for {key}; wait for earlier ones to finish"
+                )
+            ticket = RequestTicket(key, session_id)
+            sessions.setdefault(session_id, deque()).append(ticket)
+            self._dispatch(key)
+            return ticket
+    
+    def _dispatch(self, key):
+        sessions = self._queues[key]
+        while sessions and self._active[key] < self._limit(key):
+            session_id, waiting = sessions.popitem(last=False)
+            ticket = waiting.popleft()
+            if waiting:
+                # Send the session to the back of the line for its next request
+                sessions[session_id] = waiting
+            ticket.admitted = True
+            self._active[key] += 1
+            if ticket.on_admit is not None:
+                ticket.on_admit()
+        self._cond.notify_all()
+    
+    def wait(self, ticket, timeout=None):
+        """Block until the ticket is admitted; returns False if timeout expires first"""
+        with self._cond:
+            return self._cond.wait_for(lambda: ticket.admitted, timeout)
+    
+    def position(self, ticket):
+        """1-based number of requests that will be admitted no later than this one"""
+        with self._cond:
+            if ticket.admitted:
+                return 0
+            sessions = list(self._queues[ticket.key].items())
+            order = [session_id for session_id, _ in sessions]
+            if ticket.session_id not in order:
+                return 0
+            own_index = order.index(ticket.session_id)
+            waiting = dict(sessions)
+            depth = list(waiting[ticket.session_id]).index(ticket)
+            ahead = depth
+            for index, session_id in enumerate(order):
+                if session_id == ticket.session_id:
+                    continue
+                rounds = depth + 1 if index < own_index else depth
+                ahead += min(len(waiting[session_id]), rounds)
+            return ahead + 1
+    
+    def release(self, ticket):
+        """Give back a slot, or withdraw the ticket if it was still waiting"""
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.admitted:
+                self._active[ticket.key] -= 1
+            else:
+                sessions = self._queues[ticket.key]
+                waiting = sessions.get(ticket.session_id)
+                if waiting is not None and ticket in waiting:
+                    waiting.remove(ticket)
+                    if not waiting:
+                        del sessions[ticket.session_id]
+            self._dispatch(ticket.key)
+    
+    def snapshot(self):
+        """Active and queued request counts per model"""
+        with self._cond:
+            keys = set(self._active) | set(self._queues)
+            return {
+                key: {
+                    "active": self._active[key],
+                    "queued": sum(len(waiting) for waiting in self._queues[key].values())
+                }
+                for key in keys
+            }
+
+request_scheduler = RequestScheduler()
+
+async def wait_for_turn(ticket):
+    """Yield the ticket's queue position until it is admitted, without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    admitted = asyncio.Event()
+    ticket.on_admit = lambda: loop.call_soon_threadsafe(admitted.set)
+    if ticket.admitted:
+        return
+    while True:
+        try:
+            await asyncio.wait_for(admitted.wait(), QUEUE_POLL_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            yield request_scheduler.position(ticket)
+
+@contextmanager
+def scheduled(key, session_id="background"):
+    """Hold a scheduler slot for key for the duration of the block"""
+    ticket = request_scheduler.enqueue(key, session_id)
+    try:
+        request_scheduler.wait(ticket)
+        yield ticket
+    finally:
+        request_scheduler.release(ticket)
+
+@asynccontextmanager
+async def async_scheduled(key, session_id="background"):
+    """Async version of scheduled()"""
+    ticket = request_scheduler.enqueue(key, session_id)
+    try:
+        async for _ in wait_for_turn(ticket):
+            pass
+        yield ticket
+    finally:
+        request_scheduler.release(ticket)
+
+def session_id_for(request):
+    """Identify the browser session behind a Gradio request"""
+    return getattr(request, 'session_hash', None) or "anonymous"
+
+OLLAMA_METRIC_FIELDS = ("prompt_eval_count", "prompt_eval_duration", "eval_count",
+                        "eval_duration", "load_duration", "total_duration")
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+class InferenceMetrics:
+    """Per-turn inference measurements, aggregated per model.
+
+    Each turn records our own wall-clock timings (time to first token, total
+    time) together with the counters Ollama returns on the final chunk
+    (prompt_eval_count/duration, eval_count/duration, load_duration).
+    Recent samples are kept per model for percentiles; lifetime totals are
+    kept separately so the Prometheus counters never go backwards.
+    """
+    
+    def __init__(self, samples_per_model=METRICS_SAMPLES_PER_MODEL):
+        self.samples_per_model = samples_per_model
+        self._samples = defaultdict(lambda: deque(maxlen=self.samples_per_model))
+        self._totals = defaultdict(lambda: defaultdict(float))
+        self._recent = deque(maxlen=200)
+        self._lock = threading.Lock()
+    
+    def record(self, model_name, time_to_first_token, total_time, chunk_count, ollama_stats=None):
+        sample = {
+            "model": model_name,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "time_to_first_token": time_to_first_token,
+            "total_time": total_time,
+            "chunks": chunk_count
+        }
+        for field in OLLAMA_METRIC_FIELDS:
+            sample[field] = (ollama_stats or {}).get(field) or 0
+        with self._lock:
+            self._samples[model_name].append(sample)
+            self._recent.append(sample)
+            totals = self._totals[model_name]
+            totals["requests"] += 1
+            totals["total_seconds"] += total_time
+            if time_to_first_token is not None:
+                totals["first_tokens"] += 1
+                totals["first_token_seconds"] += time_to_first_token
+            for field in OLLAMA_METRIC_FIELDS:
+                totals[field] += sample[field]
+        return sample
+    
+    def recent(self, limit=50):
+        with self._lock:
+            return list(self._recent)[-limit:]
+    
+    def summary(self):
+        """Per-model aggregates: latency percentiles, throughput and load-time share"""
+        with self._lock:
+            samples = {model: list(values) for model, values in self._samples.items()}
+        summary = {}
+        for model, values in samples.items():
+            latencies = [v["total_time"] for v in values]
+            first_tokens = [v["time_to_first_token"] for v in values if v["time_to_first_token"] is not None]
+            eval_count = sum(v["eval_count"] for v in values)
+            eval_seconds = sum(v["eval_duration"] for v in values) / 1e9
+            prompt_count = sum(v["prompt_eval_count"] for v in values)
+            prompt_seconds = sum(v["prompt_eval_duration"] for v in values) / 1e9
+            load_seconds = sum(v["load_duration"] for v in values) / 1e9
+            server_seconds = sum(v["total_duration"] for v in values) / 1e9
+            summary[model] = {
+                "turns": len(values),
+                "latency_p50": percentile(latencies, 0.5),
+                "latency_p95": percentile(latencies, 0.95),
+                "ttft_p50": percentile(first_tokens, 0.5),
+                "ttft_p95": percentile(first_tokens, 0.95),
+                "tokens_per_second": eval_count / eval_seconds if eval_seconds else None,
+                "prompt_tokens_per_second": prompt_count / prompt_seconds if prompt_seconds else None,
+                "load_share": load_seconds / server_seconds if server_seconds else None
+            }
+        return summary
+    
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            totals = {model: dict(values) for model, values in self._totals.items()}
+        summary = self.summary()
+        
+        def label(model):
+            return model.replace('\\', '\\\\').replace('"', '\\"')
+        
+        def number(value):
+            # Shortest exact representation; :g would round to 6 significant digits
+            return repr(float(value))
+        
+        lines = []
+        counters = [
+            ("localgpt_chat_requests_total", "Completed chat turns.", "requests", 1),
+            ("localgpt_prompt_tokens_total", "Prompt tokens evaluated by Ollama.", "prompt_eval_count", 1),
+            ("localgpt_generated_tokens_total", "Tokens generated by Ollama.", "eval_count", 1),
+            ("localgpt_prompt_eval_seconds_total", "Time Ollama spent evaluating prompts.", "prompt_eval_duration", 1e-9),
+            ("localgpt_eval_seconds_total", "Time Ollama spent generating tokens.", "eval_duration", 1e-9),
+            ("localgpt_load_seconds_total", "Time Ollama spent loading models.", "load_duration", 1e-9),
+            ("localgpt_request_seconds_total", "Wall-clock time of chat turns.", "total_seconds", 1),
+        ]
+        for name, help_text, field, scale in counters:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for model, values in sorted(totals.items()):
+                lines.append(f'{name}{{model="{label(model)}"}} {number(values.get(field, 0) * scale)}')
+        
+        # Quantiles cover the recent samples; _sum and _count are lifetime totals
+        summaries = [
+            ("localgpt_request_latency_seconds", "Chat turn latency.", "latency", "total_seconds", "requests"),
+            ("localgpt_time_to_first_token_seconds", "Time to first token.", "ttft", "first_token_seconds", "first_tokens"),
+        ]
+        for name, help_text, prefix, sum_field, count_field in summaries:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} summary")
+            for model, values in sorted(totals.items()):
+                stats = summary.get(model) or {}
+                for quantile, key in (("0.5", "p50"), ("0.95", "p95")):
+                    value = stats.get(f"{prefix}_{key}")
+                    if value is not None:
+                        lines.append(f'{name}{{model="{label(model)}",quantile="{quantile}"}} {number(value)}')
+                lines.append(f'{name}_sum{{model="{label(model)}"}} {number(values.get(sum_field, 0))}')
+                lines.append(f'{name}_count{{model="{label(model)}"}} {number(values.get(count_field, 0))}')
+        
+        lines.append("# HELP localgpt_generation_tokens_per_second Generation throughput over recent turns.")
+        lines.append("# TYPE localgpt_generation_tokens_per_second gauge")
+        for model, stats in sorted(summary.items()):
+            if stats["tokens_per_second"] is not None:
+                lines.append(f'localgpt_generation_tokens_per_second{{model="{label(model)}"}} {number(stats["tokens_per_second"])}')
+        return "\n".join(lines) + "\n"
+
+inference_metrics = InferenceMetrics()
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves inference_metrics at /metrics for Prometheus scrapes"""
+    
+    def do_GET(self):
+        if self.path.split('?')[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = inference_metrics.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port=METRICS_PORT):
+    """Expose /metrics on localhost in a background thread (port 0 disables it)"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+    except OSError as e:
+        print(f"Couldn't start metrics endpoint on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Prometheus metrics available at http://127.0.0.1:{port}/metrics")
+    return server
+
+def record_turn_timing(model_name, time_to_first_token, total_time, chunk_count, ollama_stats=None):
+    """Record latency numbers and Ollama's counters for a single streamed chat turn"""
+    timing = inference_metrics.record(model_name, time_to_first_token, total_time, chunk_count, ollama_stats)
+    ttft = f"{time_to_first_token:.2f}s" if time_to_first_token is not None else "n/a"
+    print(f"Chat turn on {model_name}: first token {ttft}, total {total_time:.2f}s, {chunk_count} chunks")
+    return timing
+
+async def stream_chat(model_name, messages, options=None):
+    """Stream a chat completion from Ollama, yielding the accumulated text.
+
+    Updates are coalesced so that at most one partial result is yielded every
+    STREAM_UPDATE_INTERVAL seconds; the final text is always yielded last.
+    """
+    start_time = time.perf_counter()
+    first_token_time = None
+    last_update = start_time
+    chunk_count = 0
+    parts = []
+    ollama_stats = {}
+
+    last_error = None
+    for backend in backend_pool.candidates(model_name):
+        try:
+            with backend_pool.track(backend):
+                stream = await get_async_client(backend.host).chat(
+                    model=model_name, messages=messages, stream=True,
+                    options=options, keep_alive=KEEP_ALIVE
+                )
+                async for chunk in stream:
+                    if chunk.get('done'):
+                        ollama_stats = {field: chunk.get(field) for field in OLLAMA_METRIC_FIELDS}
+                    piece = chunk['message']['content']
+                    if not piece:
+                        continue
+                    chunk_count += 1
+                    parts.append(piece)
+                    now = time.perf_counter()
+                    if first_token_time is None:
+                        first_token_time = now
+                        last_update = now
+                        yield "".join(parts)
+                    elif now - last_update >= STREAM_UPDATE_INTERVAL:
+                        last_update = now
+                        yield "".join(parts)
+            backend_pool.note_loaded(backend, model_name)
+            residency_manager.touch(backend.host, model_name)
+            last_error = None
+            break
+        except Exception as e:
+            if not is_connection_error(e):
+                raise
+            # Host went away; start the reply over on the next candidate
+            backend_pool.mark_failed(backend, e)
+            last_error = e
+            parts = []
+            chunk_count = 0
+    if last_error is not None:
+        raise last_error
+
+    end_time = time.perf_counter()
+    record_turn_timing(
+        model_name,
+        first_token_time - start_time if first_token_time is not None else None,
+        end_time - start_time,
+        chunk_count,
+        ollama_stats
+    )
+    yield "".join(parts)
+
+async def chat_with_model(message, history, model_name, system_instruction=None):
+    """Stream a reply, yielding the partial response text as it grows"""
     try:
         messages = []
         if system_instruction:
@@ -207,10 +1179,19 @@ def chat_with_model(message, history, model_name, system_instruction=None):
         
         messages.append({"role": "user", "content": message})
         
-        response = ollama.chat(model=model_name, messages=messages)
-        return response['message']['content']
+        async with async_scheduled(model_name):
+            async for partial in stream_chat(model_name, messages):
+                yield partial
     except Exception as e:
-        return f"Error: {str(e)}"
+        yield f"Error: {str(e)}"
+
+def format_size(num_bytes):
+    """Human-readable byte count"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
 
 def format_time(seconds):
     if seconds < 60:
@@ -232,8 +1213,313 @@ def calculate_eta(downloaded, total, elapsed_time):
     eta_seconds = remaining_bytes / rate if rate > 0 else 0
     return format_time(eta_seconds)
 
-def handle_model_action(evt: gr.SelectData, models_data, model_dropdown_component):
-    """Handle model installation/removal with dropdown update"""
+class DownloadJob:
+    """One model pull and its byte-level progress"""
+    
+    ACTIVE = ("queued", "downloading")
+    
+    def __init__(self, model_name, state="queued"):
+        self.model = model_name
+        self.state = state
+        self.host = ""
+        self.status = ""
+        self.error = ""
+        # Layer digest -> [completed_bytes, total_bytes]
+        self.layers = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Bytes already on disk when this run started (Ollama resumes partial layers)
+        self.baseline = None
+        self.cancel_requested = threading.Event()
+    
+    @property
+    def completed(self):
+        return sum(done for done, _ in self.layers.values())
+    
+    @property
+    def total(self):
+        return sum(total for _, total in self.layers.values())
+    
+    def to_dict(self):
+        return {
+            "model": self.model,
+            "state": self.state,
+            "host": self.host,
+            "status": self.status,
+            "error": self.error,
+            "layers": self.layers,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data["model"], data.get("state", "queued"))
+        job.host = data.get("host", "")
+        job.status = data.get("status", "")
+        job.error = data.get("error", "")
+        job.layers = {digest: list(progress) for digest, progress in (data.get("layers") or {}).items()}
+        job.created_at = data.get("created_at") or time.time()
+        job.finished_at = data.get("finished_at")
+        return job
+
+class DownloadManager:
+    """Background queue of model pulls.
+
+    Pulls run in PULL_CONCURRENCY worker threads (admitted through the
+    scheduler's pull queue) instead of inside a click handler, so they keep
+    going when the browser tab is closed or reloaded. Progress is tracked in
+    bytes per layer; the UI polls rows() on a timer rather than being sent
+    every streamed chunk. The job list is saved to DOWNLOADS_FILE and jobs
+    that were queued or running are picked up again on the next start.
+    Cancelling stops the stream; resuming pulls again, and Ollama skips the
+    bytes it already has.
+    """
+    
+    SAVE_INTERVAL = 1.0
+    
+    def __init__(self, path=DOWNLOADS_FILE, workers=PULL_CONCURRENCY):
+        self.path = path
+        self.workers = max(1, workers)
+        self.jobs = OrderedDict()
+        # Bumped whenever a download finishes, so pages know to refresh their model lists
+        self.version = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._started = False
+        self._last_save = 0.0
+    
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for data in saved.get("jobs", []):
+            job = DownloadJob.from_dict(data)
+            if job.state in DownloadJob.ACTIVE:
+                job.state = "queued"
+                self._queue.append(job)
+            self.jobs[job.model] = job
+        if self._queue:
+            print(f"Resuming {len(self._queue)} interrupted download(s)")
+    
+    def _save(self, force=False):
+        """Write the job list, at most once per SAVE_INTERVAL unless forced (caller holds _cond)"""
+        now = time.time()
+        if not force and now - self._last_save < self.SAVE_INTERVAL:
+            return
+        self._last_save = now
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(f"{self.path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump({"jobs": [job.to_dict() for job in self.jobs.values()]}, f)
+            os.replace(f"{self.path}.tmp", self.path)
+        except OSError as e:
+            print(f"Couldn't save download list: {e}")
+    
+    def start(self):
+        """Load saved jobs and start the worker threads"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            self._load()
+        for _ in range(self.workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+    
+    def enqueue(self, model_name):
+        """Queue a pull for model_name (a no-op if one is already queued or running)"""
+        with self._cond:
+            job = self.jobs.get(model_name)
+            if job is not None and job.state in DownloadJob.ACTIVE:
+                return job
+            job = DownloadJob(model_name)
+            self.jobs.pop(model_name, None)
+            self.jobs[model_name] = job
+            self._queue.append(job)
+            self._save(force=True)
+            self._cond.notify()
+            return job
+    
+    def cancel(self, model_name):
+        with self._cond:
+            job = self.jobs.get(model_name)
+            if job is None or job.state not in DownloadJob.ACTIVE:
+                return False
+            if job in self._queue:
+                self._queue.remove(job)
+                job.state = "cancelled"
+                job.finished_at = time.time()
+                self._save(force=True)
+            else:
+                job.cancel_requested.set()
+            return True
+    
+    def resume(self, model_name):
+        """Re-queue a cancelled or failed pull"""
+        with self._cond:
+            job = self.jobs.get(model_name)
+            if job is None or job.state not in ("cancelled", "failed"):
+                return False
+        self.enqueue(model_name)
+        return True
+    
+    def toggle(self, model_name):
+        """Cancel an active download or resume a stopped one; returns a status line"""
+        job = self.jobs.get(model_name)
+        if job is None:
+            return ""
+        if job.state in DownloadJob.ACTIVE:
+            self.cancel(model_name)
+            return f"Cancelling download of {model_name}"
+        if self.resume(model_name):
+            return f"Resuming download of {model_name}"
+        return ""
+    
+    def clear_finished(self):
+        with self._cond:
+            for name in [name for name, job in self.jobs.items() if job.state not in DownloadJob.ACTIVE]:
+                del self.jobs[name]
+            self._save(force=True)
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job = self._queue.popleft()
+            self._run(job)
+    
+    def _run(self, job):
+        try:
+            with scheduled(RequestScheduler.PULL_KEY, "downloads"):
+                backend = backend_pool.candidates(job.model)[0]
+                with self._cond:
+                    if job.cancel_requested.is_set():
+                        job.state = "cancelled"
+                        job.finished_at = time.time()
+                        return
+                    job.state = "downloading"
+                    job.host = backend.label
+                    job.started_at = time.time()
+                    job.baseline = None
+                with backend_pool.track(backend):
+                    stream = get_ollama_client(backend.host).pull(job.model, stream=True)
+                    try:
+                        for response in stream:
+                            if job.cancel_requested.is_set():
+                                break
+                            self._update(job, response)
+                    finally:
+                        stream.close()
+            with self._cond:
+                job.finished_at = time.time()
+                if job.cancel_requested.is_set():
+                    job.state = "cancelled"
+                    return
+                job.state = "done"
+                job.status = "success"
+            self._installed(job.model)
+            print(f"Downloaded {job.model} on {job.host} in {format_time(job.finished_at - job.started_at)}")
+        except Exception as e:
+            with self._cond:
+                job.state = "failed"
+                job.error = str(e)
+                job.finished_at = time.time()
+            print(f"Download of {job.model} failed: {e}")
+        finally:
+            job.cancel_requested.clear()
+            with self._cond:
+                self._save(force=True)
+    
+    def _update(self, job, response):
+        with self._cond:
+            job.status = response.get('status') or job.status
+            digest = response.get('digest')
+            total = response.get('total')
+            if digest and total:
+                job.layers[digest] = [response.get('completed') or 0, total]
+                if job.baseline is None:
+                    job.baseline = job.completed
+            self._save()
+    
+    def _installed(self, model_name):
+        """Drop everything cached about a model after it was (re)installed"""
+        model_catalog.invalidate("installed")
+        _model_context_lengths.pop(model_name, None)
+        response_cache.invalidate_model(model_name)
+        backend_pool.probe_all()
+        with self._cond:
+            self.version += 1
+    
+    def progress_text(self, job):
+        """Bytes done, rate and ETA for a job"""
+        completed, total = job.completed, job.total
+        if not total:
+            return job.status or job.state, "", ""
+        progress = f"{format_size(completed)} / {format_size(total)} ({completed / total:.0%})"
+        if job.state != "downloading" or not job.started_at:
+            return progress, "", ""
+        elapsed = max(time.time() - job.started_at, 1e-6)
+        downloaded = completed - (job.baseline or 0)
+        rate = f"{format_size(downloaded / elapsed)}/s" if downloaded > 0 else ""
+        return progress, rate, calculate_eta(downloaded, total - (job.baseline or 0), elapsed)
+    
+    def rows(self):
+        """Rows for the downloads table, newest first"""
+        labels = {
+            "queued": "⏳ Queued",
+            "downloading": "⬇ Downloading",
+            "done": "✓ Installed",
+            "cancelled": "✗ Cancelled",
+            "failed": "✗ Failed"
+        }
+        actions = {"queued": "Cancel", "downloading": "Cancel", "cancelled": "Resume", "failed": "Retry"}
+        with self._cond:
+            jobs = list(self.jobs.values())
+        rows = []
+        for job in reversed(jobs):
+            progress, rate, eta = self.progress_text(job)
+            state = labels.get(job.state, job.state)
+            if job.state == "failed" and job.error:
+                state = f"{state}: {job.error}"
+            rows.append([job.model, job.host, state, progress, rate, eta, actions.get(job.state, "")])
+        return rows
+
+download_manager = DownloadManager()
+
+def poll_downloads(seen_version, search_term="", category="All"):
+    """Timer callback: download rows, plus fresh model lists if a download finished.
+
+    The models table is re-filtered with the current search text and
+    category, so a finished download doesn't reset what the user is viewing.
+    """
+    rows = download_manager.rows() or [["", "", "", "", "", "", ""]]
+    version = download_manager.version
+    if version == seen_version:
+        return rows, gr.update(), gr.update(), seen_version
+    models = search_models(search_term, category)
+    installed_models = list(get_installed_models().keys())
+    return rows, models, gr.Dropdown(choices=installed_models), version
+
+def handle_download_action(evt: "gr.SelectData", downloads_data):
+    """Cancel or resume the clicked download"""
+    rows = downloads_data.values.tolist() if hasattr(downloads_data, 'values') else downloads_data
+    if not evt or not hasattr(evt, 'index') or not rows:
+        return gr.update(), download_manager.rows()
+    model_name = rows[evt.index[0]][0]
+    return download_manager.toggle(model_name) or gr.update(), download_manager.rows()
+
+def clear_finished_downloads():
+    download_manager.clear_finished()
+    return download_manager.rows()
+
+async def handle_model_action(evt: "gr.SelectData", models_data, model_dropdown_component):
+    """Queue a model download, or remove an installed model and update the dropdown"""
     try:
         models_list = models_data.values.tolist() if hasattr(models_data, 'values') else models_data
         
@@ -245,43 +1531,36 @@ def handle_model_action(evt: gr.SelectData, models_data, model_dropdown_componen
         model_name = selected_row[0]
         current_status = selected_row[4]
         
-        progress_text = ""
+        if "✓" not in str(current_status):  # Install model in the background
+            job = download_manager.enqueue(model_name)
+            state = "already downloading" if job.state == "downloading" else "queued for download"
+            yield (
+                f"{model_name} is {state}. Progress is shown under Downloads and continues "
+                f"if you close or reload this page."
+            ), models_data, gr.update()
+            return
         
-        if "✓" not in str(current_status):  # Install model
-            progress_text = f"Starting installation of {model_name}...\n"
-            yield progress_text, models_data, gr.update()
+        progress_text = f"Removing {model_name}...\n"
+        yield progress_text, models_data, gr.update()
+        
+        try:
+            # Remove the model from every host that has it
+            for backend in backend_pool.hosts_with(model_name) or backend_pool.backends[:1]:
+                await get_async_client(backend.host).delete(model_name)
+            progress_text += f"✅ Successfully removed {model_name}!"
             
-            try:
-                for response in ollama.pull(model_name, stream=True):
-                    if 'status' in response:
-                        progress_text += f"{response['status']}\n"
-                    if 'completed' in response:
-                        progress_text += f"Progress: {response['completed']}/{response['total']} layers\n"
-                    yield progress_text, models_data, gr.update()
-                
-                progress_text += f"\n✅ Successfully installed {model_name}!"
-                
-            except Exception as install_error:
-                progress_text += f"\n❌ Installation error: {str(install_error)}"
-                yield progress_text, models_data, gr.update()
-                return
-                
-        else:  # Remove model
-            progress_text = f"Removing {model_name}...\n"
+        except Exception as remove_error:
+            progress_text += f"\n❌ Removal error: {str(remove_error)}"
             yield progress_text, models_data, gr.update()
-            
-            try:
-                ollama.rm(model_name)
-                progress_text += f"✅ Successfully removed {model_name}!"
-                
-            except Exception as remove_error:
-                progress_text += f"\n❌ Removal error: {str(remove_error)}"
-                yield progress_text, models_data, gr.update()
-                return
+            return
         
         # Update models list and dropdown
         try:
-            new_models = fetch_available_models()
+            model_catalog.invalidate("installed")
+            _model_context_lengths.pop(model_name, None)
+            response_cache.invalidate_model(model_name)
+            await asyncio.to_thread(backend_pool.probe_all)
+            new_models = await asyncio.to_thread(fetch_available_models)
             installed_models = list(get_installed_models().keys())
             yield progress_text, new_models, gr.Dropdown(choices=installed_models)
             
@@ -293,228 +1572,1920 @@ def handle_model_action(evt: gr.SelectData, models_data, model_dropdown_componen
         error_text = f"❌ Error: {str(e)}\nPlease check the console for details."
         yield error_text, models_data, gr.update()
 
-def get_model_categories(models_list):
-    """Extract unique categories from the models list and add 'All'"""
-    categories = {"All"}  # Start with 'All'
-    for model in models_list:
-        categories.add(model[1])  # Add each model's category
-    return sorted(list(categories))
+def get_model_categories(models_list):
+    """Extract unique categories from the models list and add 'All'"""
+    categories = {"All"}  # Start with 'All'
+    for model in models_list:
+        categories.add(model[1])  # Add each model's category
+    return sorted(list(categories))
+
+def search_tokens(text):
+    """Lowercased alphanumeric tokens used by the model search index"""
+    return re.findall(r"[a-z0-9]+", (text or "").lower())
+
+class ModelSearchIndex:
+    """Precomputed search index over the full model catalog.
+
+    Name and description tokens map to posting sets of row numbers, and a
+    sorted token list answers prefix lookups with bisect, so "lla" finds
+    every llama tag. Categories are bucketed the same way. A query matches
+    rows containing a prefix match for every one of its tokens; results keep
+    the catalog's order.
+    """
+    
+    def __init__(self, rows):
+        self.rows = rows
+        self.postings = defaultdict(set)
+        self.categories = defaultdict(set)
+        for i, row in enumerate(rows):
+            self.categories[row[1]].add(i)
+            for token in search_tokens(f"{row[0]} {row[3]}"):
+                self.postings[token].add(i)
+        self.tokens = sorted(self.postings)
+    
+    def prefix_matches(self, prefix):
+        """Row numbers with any token starting with prefix"""
+        matches = set()
+        for i in range(bisect_left(self.tokens, prefix), len(self.tokens)):
+            token = self.tokens[i]
+            if not token.startswith(prefix):
+                break
+            matches |= self.postings[token]
+        return matches
+    
+    def search(self, search_term="", category="All"):
+        candidates = None
+        if category and category != "All":
+            candidates = set(self.categories.get(category, ()))
+        # Longest tokens first: they usually have the fewest matches
+        for token in sorted(set(search_tokens(search_term)), key=len, reverse=True):
+            matches = self.prefix_matches(token)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                return []
+        if candidates is None:
+            return list(self.rows)
+        return [self.rows[i] for i in sorted(candidates)]
+
+_model_search_index = None
+_model_search_lock = threading.Lock()
+
+def get_model_search_index():
+    """Search index for the current catalog, rebuilt when the catalog changes"""
+    global _model_search_index
+    with _model_search_lock:
+        generation = model_catalog.generation
+        if _model_search_index is None or _model_search_index[0] != generation:
+            # Building may itself refresh the catalog; record the generation it ended on
+            index = ModelSearchIndex(fetch_available_models())
+            _model_search_index = (model_catalog.generation, index)
+        return _model_search_index[1]
+
+def search_models(search_term, category):
+    """Rows of the full catalog matching the search and category"""
+    return get_model_search_index().search(search_term, category)
+
+async def debounced_search_models(search_term, category):
+    """Search after a short pause, so a burst of keystrokes runs one search"""
+    await asyncio.sleep(MODEL_SEARCH_DEBOUNCE)
+    return await asyncio.to_thread(search_models, search_term, category)
+
+async def chat_response(message, history, model_name, system_prompt, request: "gr.Request" = None):
+    """Chat function that takes model and system prompt as parameters"""
+    history = history or []
+    try:
+        system_inst = system_prompt if system_prompt else "You are a helpful AI assistant."
+        
+        messages = [{"role": "system", "content": system_inst}]
+        for user_msg, assistant_msg in history:
+            messages.extend([
+                {"role": "user", "content": user_msg},
+                {"role": "assistant", "content": assistant_msg}
+            ])
+        messages.append({"role": "user", "content": message})
+        
+        history.append([message, ""])
+        yield "", history
+        
+        async with async_scheduled(model_name, session_id_for(request)):
+            async for partial in stream_chat(model_name, messages):
+                history[-1][1] = partial
+                yield "", history
+        
+    except Exception as e:
+        error_message = f"Error: {str(e)}\nPlease ensure a model is selected and Ollama is running."
+        if history and history[-1][0] == message and not history[-1][1]:
+            history[-1][1] = error_message
+        else:
+            history.append([message, error_message])
+        yield "", history
+
+def extract_pdf_pages(file_path, start, end):
+    """Extract the text of pages [start, end) from a PDF (runs in worker processes)"""
+    import PyPDF2
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+def get_extraction_pool():
+    """Shared process pool for page-parallel PDF extraction, created on first use"""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+        return _extraction_pool
+
+def iter_pdf_text(file_path):
+    """Yield (pages_done, total_pages, page_texts) for a PDF, in page order.
+
+    Large PDFs are split into batches of PDF_PAGES_PER_TASK pages and extracted
+    across the process pool. Only a small window of batches is in flight at
+    once, so memory use doesn't grow with the size of the file.
+    """
+    import PyPDF2
+    with open(file_path, 'rb') as f:
+        total_pages = len(PyPDF2.PdfReader(f).pages)
+    if total_pages > MAX_PDF_PAGES:
+        raise ValueError(f"PDF has {total_pages} pages; the limit is {MAX_PDF_PAGES}")
+    
+    batches = [(start, min(start + PDF_PAGES_PER_TASK, total_pages))
+               for start in range(0, total_pages, PDF_PAGES_PER_TASK)]
+    
+    if total_pages < PARALLEL_PDF_MIN_PAGES or EXTRACTION_WORKERS <= 1:
+        for start, end in batches:
+            yield end, total_pages, extract_pdf_pages(file_path, start, end)
+        return
+    
+    pool = get_extraction_pool()
+    remaining = iter(batches)
+    pending = deque(
+        (end, pool.submit(extract_pdf_pages, file_path, start, end))
+        for start, end in islice(remaining, EXTRACTION_WORKERS * 2)
+    )
+    while pending:
+        end, future = pending.popleft()
+        texts = future.result()
+        next_batch = next(remaining, None)
+        if next_batch:
+            pending.append((next_batch[1], pool.submit(extract_pdf_pages, file_path, *next_batch)))
+        yield end, total_pages, texts
+
+def file_sha256(file_path):
+    """SHA-256 of a file's bytes, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ExtractionCache:
+    """On-disk cache of extracted text keyed by file SHA-256 and extractor version.
+
+    Uses file mtimes as LRU access times and evicts the oldest entries
+    once the directory grows past its size budget.
+    """
+    
+    def __init__(self, directory=EXTRACTION_CACHE_DIR, budget_mb=EXTRACTION_CACHE_BUDGET_MB):
+        self.directory = directory
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    def make_key(self, file_hash, extension):
+        return hashlib.sha256(f"{file_hash}:{extension}:{EXTRACTOR_VERSION}".encode('utf-8')).hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+    
+    def get(self, key):
+        """Return cached text for key (counting a hit or miss), or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return content
+    
+    def put(self, key, content):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(f"{path}.tmp", path)
+        with self._lock:
+            evict_lru_entries(self.directory, self.budget_bytes, ('.txt',))
+    
+    def stats(self):
+        return f"cache hits {self.hits}, misses {self.misses}"
+
+extraction_cache = ExtractionCache()
+
+def process_file_with_progress(file):
+    """Extract text from an uploaded file, yielding (content, status) pairs.
+
+    content is None until extraction finishes; the final pair carries the text.
+    Raises ValueError when the file exceeds the configured size or page limits.
+    """
+    file_path = file if isinstance(file, str) else file.name
+    file_name = os.path.basename(file_path)
+    size_mb = os.path.getsize(file_path) / (1024 * 1024)
+    if size_mb > MAX_UPLOAD_MB:
+        raise ValueError(f"{file_name} is {size_mb:.1f} MB; the limit is {MAX_UPLOAD_MB:g} MB")
+    
+    cache_key = extraction_cache.make_key(file_sha256(file_path), os.path.splitext(file_path)[1].lower())
+    content = extraction_cache.get(cache_key)
+    if content is not None:
+        yield content, f"Loaded {file_name} ({len(content):,} characters) from cache ({extraction_cache.stats()})"
+        return
+    
+    content = ""
+    # Handle different file types
+    if file_path.endswith('.txt') or file_path.endswith('.md'):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+    elif file_path.endswith('.pdf'):
+        page_texts = []
+        for pages_done, total_pages, texts in iter_pdf_text(file_path):
+            page_texts.extend(texts)
+            yield None, f"Extracting {file_name}: page {pages_done}/{total_pages}"
+        content = ' '.join(page_texts)
+    elif file_path.endswith('.doc') or file_path.endswith('.docx'):
+        import docx
+        doc = docx.Document(file_path)
+        content = ' '.join(paragraph.text for paragraph in doc.paragraphs)
+    
+    try:
+        extraction_cache.put(cache_key, content)
+    except Exception as e:
+        print(f"Couldn't cache extracted text: {e}")
+    yield content, f"Loaded {file_name} ({len(content):,} characters), cache miss ({extraction_cache.stats()})"
+
+def process_file(file):
+    """Process uploaded file and return its content"""
+    if file is None:
+        return None
+    
+    try:
+        content = None
+        for content, _ in process_file_with_progress(file):
+            pass
+        print(f"Processed file content length: {len(content)}")
+        return content
+    except Exception as e:
+        print(f"Error processing file: {e}")
+        return None
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Split text into overlapping chunks, preferring to break on whitespace"""
+    text = text.strip() if text else ""
+    if not text:
+        return []
+    if len(text) <= chunk_size:
+        return [text]
+    
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            # Back up to the last whitespace so words aren't cut in half
+            split_at = text.rfind(' ', start + chunk_size // 2, end)
+            if split_at != -1:
+                end = split_at
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+def embed_batch(client, model_name, texts):
+    """Embed texts on one client, using the batch endpoint when available"""
+    if hasattr(client, 'embed'):
+        return client.embed(model=model_name, input=texts)['embeddings']
+    return [client.embeddings(model=model_name, prompt=text)['embedding'] for text in texts]
+
+def embed_texts(texts, model_name=EMBEDDING_MODEL, session_id="background"):
+    """Embed a list of texts with Ollama and return a float32 matrix"""
+    vectors = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = texts[i:i + EMBEDDING_BATCH_SIZE]
+        with scheduled(model_name, session_id):
+            vectors.extend(call_with_failover(model_name, lambda client: embed_batch(client, model_name, batch)))
+    return np.asarray(vectors, dtype=np.float32)
+
+def content_hash(text):
+    """Stable hash used to tie an index to the document it was built from"""
+    return hashlib.sha256((text or "").encode('utf-8')).hexdigest()
+
+class DocumentRef:
+    """A saved project's document, held by hash until a turn actually needs the text.
+
+    Loading a project puts one of these in the session instead of the
+    decompressed document; resolve_document() fetches the text from the
+    project store (which caches recently used documents) on demand.
+    """
+    
+    __slots__ = ("file_hash",)
+    
+    def __init__(self, file_hash):
+        self.file_hash = file_hash or ""
+    
+    def __bool__(self):
+        return bool(self.file_hash)
+    
+    def __eq__(self, other):
+        return isinstance(other, DocumentRef) and other.file_hash == self.file_hash
+    
+    def __hash__(self):
+        return hash(self.file_hash)
+    
+    def __repr__(self):
+        return f"DocumentRef({self.file_hash[:12]!r})"
+
+def resolve_document(file_content):
+    """Document text for a session value that is either the text itself or a DocumentRef"""
+    if isinstance(file_content, DocumentRef):
+        return get_project_store().load_document(file_content.file_hash)
+    return file_content or ""
+
+def document_hash(file_content):
+    """content_hash of the document, without loading it when only a DocumentRef is held"""
+    if isinstance(file_content, DocumentRef):
+        return file_content.file_hash
+    return content_hash(file_content)
+
+def normalize_rows(vectors):
+    """Scale each row to unit length so a dot product gives cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+class DocumentIndex:
+    """Vector index over the chunks of one document.
+
+    `vectors` must already be row-normalized; it may be a read-only memory map
+    shared with other sessions through the EmbeddingStore.
+    """
+    
+    def __init__(self, chunks, vectors, source_hash, model_name):
+        self.chunks = chunks
+        self.source_hash = source_hash
+        self.model_name = model_name
+        self.vectors = vectors
+    
+    def search(self, query, top_k=RETRIEVAL_TOP_K, session_id="background"):
+        """Return the top_k chunks most similar to the query, in document order"""
+        if not self.chunks:
+            return []
+        query_vector = embed_texts([query], self.model_name, session_id)[0]
+        norm = np.linalg.norm(query_vector)
+        if norm:
+            query_vector = query_vector / norm
+        scores = self.vectors @ query_vector
+        top_k = min(top_k, len(self.chunks))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        return [self.chunks[i] for i in sorted(best)]
+
+def evict_lru_entries(directory, budget_bytes, extensions):
+    """Delete least recently used cache entries until directory fits the budget.
+
+    An entry is every file sharing a name stem (one of `extensions`); its
+    last-access time is the newest mtime among them. Returns removed stems.
+    """
+    if not os.path.isdir(directory):
+        return []
+    entries = {}
+    for filename in os.listdir(directory):
+        stem, ext = os.path.splitext(filename)
+        if ext not in extensions:
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, filename))
+        except OSError:
+            continue
+        size, last_access = entries.get(stem, (0, 0))
+        entries[stem] = (size + stat.st_size, max(last_access, stat.st_mtime))
+    
+    total = sum(size for size, _ in entries.values())
+    removed = []
+    for stem, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+        if total <= budget_bytes:
+            break
+        for ext in extensions:
+            try:
+                os.remove(os.path.join(directory, stem + ext))
+            except OSError:
+                pass
+        total -= size
+        removed.append(stem)
+        print(f"Evicted cache entry {stem} from {directory} ({size} bytes)")
+    return removed
+
+class EmbeddingStore:
+    """Content-addressed on-disk cache of document embeddings.
+
+    Entries are keyed by (content hash, chunking parameters, embedding model).
+    Vectors live in .npy files opened as read-only memory maps, so every
+    session using the same document shares one copy through the page cache.
+    File modification times double as LRU access times, and the least recently
+    used entries are removed once the store grows past its disk budget.
+    """
+    
+    def __init__(self, directory=EMBEDDING_STORE_DIR, budget_mb=EMBEDDING_STORE_BUDGET_MB):
+        self.directory = directory
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self._loaded = {}
+        self._lock = threading.Lock()
+    
+    def make_key(self, source_hash, model_name, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+        raw = f"{source_hash}:{chunk_size}:{overlap}:{model_name}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return f"{base}.npy", f"{base}.json"
+    
+    def _touch(self, key):
+        for path in self._paths(key):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+    
+    def get(self, key):
+        """Return the cached DocumentIndex for key, or None"""
+        with self._lock:
+            index = self._loaded.get(key)
+            if index is None:
+                vectors_path, meta_path = self._paths(key)
+                if not (os.path.exists(vectors_path) and os.path.exists(meta_path)):
+                    return None
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                    vectors = np.load(vectors_path, mmap_mode='r')
+                except Exception as e:
+                    print(f"Discarding unreadable embedding store entry {key}: {e}")
+                    self._remove(key)
+                    return None
+                index = DocumentIndex(meta["chunks"], vectors, meta["source_hash"], meta["model"])
+                self._loaded[key] = index
+            self._touch(key)
+            return index
+    
+    def put(self, key, index):
+        """Persist an index and return a memory-mapped copy of it"""
+        os.makedirs(self.directory, exist_ok=True)
+        vectors_path, meta_path = self._paths(key)
+        meta = {
+            "source_hash": index.source_hash,
+            "model": index.model_name,
+            "chunks": index.chunks
+        }
+        # Write to temporary files first so readers never see a partial entry
+        with open(f"{vectors_path}.tmp", 'wb') as f:
+            np.save(f, np.ascontiguousarray(index.vectors, dtype=np.float32))
+        with open(f"{meta_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(f"{vectors_path}.tmp", vectors_path)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        self.evict()
+        return self.get(key) or index
+    
+    def _remove(self, key):
+        self._loaded.pop(key, None)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def evict(self):
+        """Remove least recently used entries until the store fits its budget"""
+        with self._lock:
+            for key in evict_lru_entries(self.directory, self.budget_bytes, ('.npy', '.json')):
+                self._loaded.pop(key, None)
+
+embedding_store = EmbeddingStore()
+
+def build_document_index(file_content, model_name=EMBEDDING_MODEL, session_id="background"):
+    """Return a DocumentIndex for the text, reusing stored embeddings when possible"""
+    if not file_content:
+        return None
+    source_hash = document_hash(file_content)
+    key = embedding_store.make_key(source_hash, model_name)
+    index = embedding_store.get(key)
+    if index is not None:
+        return index
+    
+    chunks = chunk_text(resolve_document(file_content))
+    if not chunks:
+        return None
+    start_time = time.perf_counter()
+    vectors = normalize_rows(embed_texts(chunks, model_name, session_id))
+    print(f"Indexed {len(chunks)} chunks with {model_name} in {time.perf_counter() - start_time:.2f}s")
+    index = DocumentIndex(chunks, vectors, source_hash, model_name)
+    try:
+        return embedding_store.put(key, index)
+    except Exception as e:
+        print(f"Could not persist embeddings: {e}")
+        return index
+
+def update_document_index(file_content, use_retrieval, request: "gr.Request" = None):
+    """Build the retrieval index for the current document when retrieval mode is on"""
+    if not use_retrieval or not file_content:
+        return None, gr.update()
+    try:
+        index = build_document_index(file_content, session_id=session_id_for(request))
+        if index is None:
+            return None, gr.update()
+        return index, f"Indexed {len(index.chunks)} passages for retrieval"
+    except Exception as e:
+        print(f"Error building document index: {e}")
+        return None, f"Retrieval unavailable ({e}); the full document will be sent"
+
+def full_document_context(file_content):
+    """Document section of the system message when the whole file is sent"""
+    return f"Document content:\n{file_content}"
+
+def build_document_context(message, file_content, use_retrieval, doc_index, session_id="background"):
+    """Return the document text to place in the system message for this turn"""
+    if not file_content:
+        return ""
+    if not use_retrieval:
+        return full_document_context(resolve_document(file_content))
+    try:
+        if doc_index is None or doc_index.source_hash != document_hash(file_content):
+            doc_index = build_document_index(file_content, session_id=session_id)
+        passages = doc_index.search(message, session_id=session_id) if doc_index else []
+    except Exception as e:
+        print(f"Retrieval failed, sending full document: {e}")
+        return full_document_context(resolve_document(file_content))
+    excerpts = "\n\n".join(f"[{i + 1}] {passage}" for i, passage in enumerate(passages))
+    return f"Relevant document excerpts:\n{excerpts}"
+
+def estimate_tokens(text):
+    """Rough token count for one message (a length check, so cheap enough to redo every turn)"""
+    return len(text or "") // CHARS_PER_TOKEN + MESSAGE_TOKEN_OVERHEAD
+
+_model_context_lengths = {}
+
+def get_model_context_length(model_name):
+    """Context length the model was trained with, as reported by Ollama's model info"""
+    if model_name in _model_context_lengths:
+        return _model_context_lengths[model_name]
+    context_length = DEFAULT_CONTEXT_LENGTH
+    try:
+        info = call_with_failover(model_name, lambda client: client.show(model_name), loads_model=False)
+        model_info = info.get('model_info') or {}
+        for key, value in model_info.items():
+            if key.endswith('.context_length'):
+                context_length = int(value)
+                break
+    except Exception as e:
+        print(f"Couldn't read context length for {model_name}: {e}")
+        # Don't cache failures; the model may simply not be pulled yet
+        return context_length
+    _model_context_lengths[model_name] = context_length
+    return context_length
+
+DOCUMENT_TRUNCATED_MARKER = "\n[Document truncated to fit the context window]"
+TEXT_TRUNCATED_MARKER = " […]"
+
+def truncate_to_tokens(text, max_tokens, marker=DOCUMENT_TRUNCATED_MARKER):
+    """Cut text down to roughly max_tokens, appending marker if it was shortened"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, (max_tokens - MESSAGE_TOKEN_OVERHEAD) * CHARS_PER_TOKEN)
+    return text[:max_chars] + marker
+
+def resolve_num_ctx(model_name):
+    """Context size to request from Ollama for this model"""
+    return min(get_model_context_length(model_name), MAX_CONTEXT_LENGTH)
+
+def build_system_message(system_instruction, document_context, num_ctx):
+    """Assemble the system message, capping the document's share of the context.
+
+    The result depends only on its arguments (never on the history or the
+    current question), so the same document produces a byte-identical prefix
+    on every turn and Ollama can reuse its prompt cache.
+    Returns the message text and its system/document token counts.
+    """
+    system_tokens = estimate_tokens(system_instruction)
+    document_tokens = 0
+    system_message = system_instruction
+    if document_context:
+        document_cap = int(max(0, num_ctx - REPLY_TOKEN_RESERVE - system_tokens) * DOCUMENT_SHARE_CAP)
+        document_context = truncate_to_tokens(document_context, document_cap)
+        document_tokens = estimate_tokens(document_context)
+        system_message = f"{system_instruction}\n\n{document_context}"
+    return system_message, system_tokens, document_tokens
+
+def budget_messages(system_instruction, document_context, history, message, num_ctx, summary=None):
+    """Fit system, document, history and message into num_ctx tokens.
+
+    The system instruction and the new message are always kept, the document
+    is capped at DOCUMENT_SHARE_CAP of the non-reserved context, and the rest
+    is filled with the newest history turns; the oldest turns are dropped first.
+    A summary of earlier turns, if given, goes in its own message right after
+    the system message so the system prefix stays cacheable.
+    Returns the Ollama message list and a per-part token breakdown.
+    """
+    system_message, system_tokens, document_tokens = build_system_message(
+        system_instruction, document_context, num_ctx
+    )
+    message_tokens = estimate_tokens(message)
+    remaining = max(0, num_ctx - REPLY_TOKEN_RESERVE - system_tokens - document_tokens - message_tokens)
+    summary_message = ""
+    summary_tokens = 0
+    if summary:
+        summary_message = truncate_to_tokens(
+            f"Summary of the earlier conversation:\n{summary['text']}", remaining // 2, TEXT_TRUNCATED_MARKER
+        )
+        summary_tokens = estimate_tokens(summary_message)
+        remaining -= summary_tokens
+    
+    kept_turns = []
+    history_tokens = 0
+    for user_msg, assistant_msg in reversed(history or []):
+        turn_tokens = estimate_tokens(user_msg) + estimate_tokens(assistant_msg)
+        if turn_tokens > remaining:
+            break
+        kept_turns.append((user_msg, assistant_msg))
+        remaining -= turn_tokens
+        history_tokens += turn_tokens
+    kept_turns.reverse()
+    
+    messages = [{"role": "system", "content": system_message}]
+    if summary_message:
+        messages.append({"role": "system", "content": summary_message})
+    for user_msg, assistant_msg in kept_turns:
+        messages.extend([
+            {"role": "user", "content": user_msg},
+            {"role": "assistant", "content": assistant_msg}
+        ])
+    messages.append({"role": "user", "content": message})
+    
+    breakdown = {
+        "num_ctx": num_ctx,
+        "system": system_tokens,
+        "document": document_tokens,
+        "history": history_tokens,
+        "history_turns_kept": len(kept_turns),
+        "history_turns_dropped": len(history or []) - len(kept_turns),
+        "summary": summary_tokens,
+        "summary_turns": summary["turns"] if summary else 0,
+        "message": message_tokens,
+        "reply_reserve": REPLY_TOKEN_RESERVE,
+        "total": system_tokens + document_tokens + summary_tokens + history_tokens + message_tokens
+    }
+    return messages, breakdown
+
+def format_context_breakdown(breakdown):
+    """Human-readable summary of a budget_messages breakdown"""
+    return (
+        f"{breakdown['total']:,} / {breakdown['num_ctx']:,} tokens "
+        f"(reserving {breakdown['reply_reserve']:,} for the reply)\n"
+        f"System: {breakdown['system']:,} | Document: {breakdown['document']:,} | "
+        f"Message: {breakdown['message']:,}\n"
+        f"History: {breakdown['history']:,} in {breakdown['history_turns_kept']} turns"
+        f" ({breakdown['history_turns_dropped']} older turns dropped)"
+        + (f"\nSummary: {breakdown['summary']:,} covering {breakdown['summary_turns']} earlier turns"
+           if breakdown.get("summary_turns") else "")
+    )
 
-def filter_models(search_term, category, models_data):
-    """Filter models based on search term and category"""
-    if not models_data:
-        return []
+def history_prefix_hashes(history):
+    """Hash of each history prefix: entry i identifies turns 0..i exactly"""
+    hashes = []
+    digest = hashlib.sha256()
+    for turn in history or []:
+        digest.update(turn_hash(turn[0], turn[1]).encode('ascii'))
+        hashes.append(digest.copy().hexdigest())
+    return hashes
+
+class ConversationSummarizer:
+    """Rolling summaries of the older part of long conversations.
+
+    Summaries are keyed by a hash of the exact turns they cover, so they can
+    be found again for any history that starts with those turns, whichever
+    session or saved project it came from. Once COMPACTION_BATCH_TURNS more
+    turns have fallen out of the most recent COMPACTION_KEEP_TURNS, a
+    background thread folds just those turns into the previous summary
+    (through the scheduler, so it waits its turn behind chat requests).
+    """
     
-    filtered_models = models_data
+    def __init__(self, keep_turns=COMPACTION_KEEP_TURNS, batch_turns=COMPACTION_BATCH_TURNS,
+                 model_name=SUMMARY_MODEL, max_entries=256):
+        self.keep_turns = keep_turns
+        self.batch_turns = max(1, batch_turns)
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._summaries = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
     
-    # Apply category filter
-    if category and category != "All":
-        filtered_models = [m for m in filtered_models if m[1] == category]
+    def remember(self, prefix_hash, turns, text):
+        with self._lock:
+            self._summaries[prefix_hash] = (turns, text)
+            self._summaries.move_to_end(prefix_hash)
+            while len(self._summaries) > self.max_entries:
+                self._summaries.popitem(last=False)
     
-    # Apply search filter
-    if search_term:
-        search_term = search_term.lower()
-        filtered_models = [
-            m for m in filtered_models 
-            if search_term in m[0].lower() or search_term in m[3].lower()
-        ]
+    def best(self, history, limit=None, hashes=None):
+        """Longest known summary of a prefix of history (at most limit turns), or None"""
+        hashes = hashes if hashes is not None else history_prefix_hashes(history)
+        limit = len(hashes) if limit is None else min(limit, len(hashes))
+        with self._lock:
+            for i in range(limit - 1, -1, -1):
+                entry = self._summaries.get(hashes[i])
+                if entry is not None:
+                    self._summaries.move_to_end(hashes[i])
+                    return {"text": entry[1], "turns": entry[0], "prefix_hash": hashes[i]}
+        return None
+    
+    def restore(self, history, summary):
+        """Reuse a summary saved with a project if it still matches the history"""
+        if not summary or not summary.get("turns"):
+            return
+        hashes = history_prefix_hashes(history)
+        turns = summary["turns"]
+        if turns <= len(hashes) and hashes[turns - 1] == summary.get("prefix_hash"):
+            self.remember(summary["prefix_hash"], turns, summary["text"])
+    
+    def schedule(self, history, chat_model):
+        """Start a background update if enough turns have aged out of the recent window"""
+        target = len(history or []) - self.keep_turns
+        if target <= 0:
+            return
+        hashes = history_prefix_hashes(history)
+        current = self.best(history, target, hashes)
+        covered = current["turns"] if current else 0
+        if target - covered < self.batch_turns:
+            return
+        target_hash = hashes[target - 1]
+        with self._lock:
+            if target_hash in self._pending:
+                return
+            self._pending.add(target_hash)
+        threading.Thread(
+            target=self._summarize,
+            args=([list(turn) for turn in history[covered:target]], current, target, target_hash,
+                  self.model_name or chat_model),
+            daemon=True
+        ).start()
     
-    return filtered_models
+    def _summarize(self, new_turns, current, target, target_hash, model_name):
+        try:
+            start_time = time.perf_counter()
+            # Keep any single long message from crowding out the rest of the batch
+            transcript = "\n\n".join(
+                f"User: {truncate_to_tokens(user_msg or '', 1000, TEXT_TRUNCATED_MARKER)}\n"
+                f"Assistant: {truncate_to_tokens(assistant_msg or '', 1000, TEXT_TRUNCATED_MARKER)}"
+                for user_msg, assistant_msg in new_turns
+            )
+            previous = current["text"] if current else "(no summary yet)"
+            prompt = (
+                f"Summary of the conversation so far:\n{previous}\n\n"
+                f"New turns:\n{transcript}\n\n"
+                "Rewrite the summary so it also covers the new turns. Keep facts, decisions, names, "
+                "numbers and open questions; drop pleasantries. Reply with the summary only."
+            )
+            messages = [
+                {"role": "system", "content": "You maintain concise running summaries of conversations."},
+                {"role": "user", "content": prompt}
+            ]
+            num_ctx = resolve_num_ctx(model_name)
+            with scheduled(model_name, "summaries"):
+                response = call_with_failover(model_name, lambda client: client.chat(
+                    model=model_name, messages=messages, keep_alive=KEEP_ALIVE,
+                    options={"num_ctx": num_ctx, "num_predict": SUMMARY_MAX_TOKENS, "temperature": 0.2}
+                ))
+            text = response['message']['content'].strip()
+            if text:
+                self.remember(target_hash, target, text)
+                print(f"Summarized {len(new_turns)} turns (now covering {target}) with {model_name} "
+                      f"in {time.perf_counter() - start_time:.1f}s")
+        except Exception as e:
+            print(f"Conversation summary failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(target_hash)
 
-def chat_response(message, history, model_name, system_prompt):
-    """Chat function that takes model and system prompt as parameters"""
+conversation_summarizer = ConversationSummarizer()
+
+def prefill_prompt_cache(model_name, system_instruction, file_content):
+    """Evaluate the system+document prefix so the first question skips that work.
+
+    Sends the exact system message chat_wrapper will build, with the same
+    num_ctx and keep_alive, and caps the reply at a single token (Ollama
+    ignores num_predict values of 0 or less, so 0 would generate a full reply).
+    """
     try:
-        system_inst = system_prompt if system_prompt else "You are a helpful AI assistant."
-        
-        response = ollama.chat(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": system_inst},
-                *[{"role": m[0], "content": m[1]} for m in history],
-                {"role": "user", "content": message}
-            ]
+        start_time = time.perf_counter()
+        num_ctx = resolve_num_ctx(model_name)
+        system_message, _, document_tokens = build_system_message(
+            system_instruction, full_document_context(resolve_document(file_content)), num_ctx
         )
-        
-        assistant_message = response['message']['content']
-        history.append([message, assistant_message])
-        return "", history
-        
+        with scheduled(model_name):
+            call_with_failover(model_name, lambda client: client.chat(
+                model=model_name,
+                messages=[{"role": "system", "content": system_message}],
+                options={"num_ctx": num_ctx, "num_predict": 1},
+                keep_alive=KEEP_ALIVE
+            ))
+        print(f"Prefilled ~{document_tokens} document tokens on {model_name} in {time.perf_counter() - start_time:.2f}s")
     except Exception as e:
-        error_message = f"Error: {str(e)}\nPlease ensure a model is selected and Ollama is running."
-        history.append([message, error_message])
-        return "", history
+        print(f"Prompt cache prefill failed: {e}")
 
-def process_file(file):
-    """Process uploaded file and return its content"""
-    if file is None:
-        return None
-    
+def start_prefill(file_content, model_name, system, use_retrieval):
+    """Kick off a background prefill for the current document, if applicable"""
+    # Retrieved excerpts change with every question, so there is no stable prefix to warm
+    if not PREFILL_ON_UPLOAD or not file_content or not model_name or use_retrieval:
+        return
+    system_instruction = system if system else "You are a helpful AI assistant."
+    threading.Thread(
+        target=prefill_prompt_cache,
+        args=(model_name, system_instruction, file_content),
+        daemon=True
+    ).start()
+
+def prepare_chat_request(message, history, model, system, file_content, use_retrieval, doc_index, compact=False,
+                         session_id="background"):
+    """Build the budgeted message list for a turn; returns (messages, num_ctx, breakdown).
+
+    Embedding calls for retrieval are queued under session_id, so they
+    count against that user's share of the model like the turn itself.
+    """
+    # Construct the system message and fit everything into the model's context window
+    document_context = build_document_context(message, file_content, use_retrieval, doc_index, session_id)
+    system_instruction = system if system else "You are a helpful AI assistant."
+    num_ctx = resolve_num_ctx(model)
     try:
-        content = ""
-        file_path = file.name
-        
-        # Handle different file types
-        if file_path.endswith('.txt') or file_path.endswith('.md'):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        elif file_path.endswith('.pdf'):
-            import PyPDF2
-            with open(file_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                content = ' '.join(page.extract_text() for page in reader.pages)
-        elif file_path.endswith('.doc') or file_path.endswith('.docx'):
-            import docx
-            doc = docx.Document(file_path)
-            content = ' '.join(paragraph.text for paragraph in doc.paragraphs)
-            
-        print(f"Processed file content length: {len(content)}")
-        return content
+        backend = backend_pool.candidates(model)[0]
+        if model not in backend.loaded:
+            residency_manager.make_room(backend, model)
     except Exception as e:
-        print(f"Error processing file: {e}")
-        return None
+        print(f"Couldn't free memory for {model}: {e}")
+    # In compaction mode, turns covered by a summary are sent as that summary
+    summary = conversation_summarizer.best(history) if compact and history else None
+    recent_history = history[summary["turns"]:] if summary else history
+    ollama_messages, breakdown = budget_messages(
+        system_instruction, document_context, recent_history, message, num_ctx, summary
+    )
+    return ollama_messages, num_ctx, breakdown
+
+def is_deterministic(options):
+    """Whether these generation options always produce the same reply"""
+    return options.get("temperature") == 0 or bool(options.get("seed"))
+
+class ResponseCache:
+    """Two-tier cache of complete replies for deterministic requests.
+
+    Keys hash the model digest, the generation options and the full message
+    list, so any change to the conversation, document or model produces a
+    miss. Recent entries are kept in an in-memory LRU; all entries are also
+    written to disk (evicted LRU past RESPONSE_CACHE_BUDGET_MB). Disk file
+    names start with a hash of the model name so a model's entries can be
+    dropped when it is re-pulled or removed.
+    """
+    
+    def __init__(self, directory=RESPONSE_CACHE_DIR, memory_entries=RESPONSE_CACHE_MEMORY_ENTRIES,
+                 budget_mb=RESPONSE_CACHE_BUDGET_MB):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+    
+    def _model_prefix(self, model_name):
+        return hashlib.sha256(model_name.encode('utf-8')).hexdigest()[:16]
+    
+    def make_key(self, model_name, digest, options, messages):
+        """Cache key for a request, or None if the model's digest is unknown"""
+        if not digest:
+            return None
+        payload = json.dumps(
+            {"digest": digest, "options": options, "messages": messages},
+            sort_keys=True, ensure_ascii=False
+        )
+        return f"{self._model_prefix(model_name)}-{content_hash(payload)}"
+    
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def _remember(self, key, response):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+    
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                response = json.load(f)["response"]
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, response)
+        return response
+    
+    def put(self, key, response):
+        with self._lock:
+            self._remember(key, response)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump({"response": response}, f, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+            evict_lru_entries(self.directory, self.budget_bytes, ('.json',))
+        except OSError as e:
+            print(f"Couldn't write response cache entry: {e}")
+    
+    def invalidate_model(self, model_name):
+        """Forget every cached reply produced by model_name"""
+        prefix = self._model_prefix(model_name) + "-"
+        with self._lock:
+            for key in [key for key in self._memory if key.startswith(prefix)]:
+                del self._memory[key]
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.startswith(prefix):
+                    try:
+                        os.remove(os.path.join(self.directory, filename))
+                    except OSError:
+                        pass
+    
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            rate = f"{hits / total:.0%}" if total else "n/a"
+            return f"{hits}/{total} hits ({rate}; memory {self.memory_hits}, disk {self.disk_hits})"
+
+response_cache = ResponseCache()
+
+def model_digest(model_name):
+    """Digest of an installed model ('' if unknown); may fetch the catalog, so keep it off the event loop"""
+    return (get_installed_models().get(model_name) or {}).get("digest") or ""
+
+def generation_options(num_ctx, temperature=None, seed=None):
+    """Ollama options for a chat turn; unset sampling values keep the model defaults"""
+    options = {"num_ctx": num_ctx}
+    if temperature is not None:
+        options["temperature"] = float(temperature)
+    if seed:
+        options["seed"] = int(seed)
+    return options
 
-def chat_wrapper(message, history, model, system, file_content):
+async def chat_wrapper(message, history, model, system, file_content, use_retrieval=False, doc_index=None,
+                       temperature=None, seed=None, use_cache=False, compact=False,
+                       request: "gr.Request" = None):
     """Chat function that properly integrates file content and system instructions"""
     try:
-        # Construct system message
-        if system and file_content:
-            system_message = f"{system}\n\nDocument content:\n{file_content}"
-        elif system:
-            system_message = system
-        elif file_content:
-            system_message = f"You are a helpful AI assistant.\n\nDocument content:\n{file_content}"
-        else:
-            system_message = "You are a helpful AI assistant."
+        def prepare():
+            prepared = prepare_chat_request(message, history, model, system, file_content, use_retrieval,
+                                            doc_index, compact, session_id_for(request))
+            return prepared, model_digest(model) if use_cache else ""
         
-        # Format messages for Ollama
-        ollama_messages = [
-            {"role": "system", "content": system_message}
-        ]
+        # Retrieval and model lookups may block on Ollama, so keep them off the event loop
+        (ollama_messages, num_ctx, breakdown), digest = await asyncio.to_thread(prepare)
+        context_usage = format_context_breakdown(breakdown)
+        options = generation_options(num_ctx, temperature, seed)
         
-        if history:
-            for exchange in history:
-                user_msg, assistant_msg = exchange
-                ollama_messages.extend([
-                    {"role": "user", "content": user_msg},
-                    {"role": "assistant", "content": assistant_msg}
-                ])
+        # Show the user's message immediately, then fill in the reply as it streams
+        new_history = (history or []) + [[message, ""]]
+        
+        cache_key = None
+        if use_cache and is_deterministic(options):
+            cache_key = response_cache.make_key(model, digest, options, ollama_messages)
+            cached = response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                new_history[-1][1] = cached
+                yield "", new_history, f"{context_usage}\nResponse cache: hit, {response_cache.stats()}"
+                return
+            context_usage = f"{context_usage}\nResponse cache: miss, {response_cache.stats()}"
         
-        ollama_messages.append({"role": "user", "content": message})
+        yield "", new_history, context_usage
         
-        response = ollama.chat(
-            model=model,
-            messages=ollama_messages
-        )
+        ticket = request_scheduler.enqueue(model, session_id_for(request))
+        try:
+            async for position in wait_for_turn(ticket):
+                new_history[-1][1] = f"⏳ Waiting for {model} (position {position} in queue)..."
+                yield "", new_history, context_usage
+            new_history[-1][1] = ""
+            
+            async for partial in stream_chat(model, ollama_messages, options=options):
+                new_history[-1][1] = partial
+                yield "", new_history, context_usage
+        finally:
+            request_scheduler.release(ticket)
         
-        assistant_message = response['message']['content']
-        new_history = history + [[message, assistant_message]] if history is not None else [[message, assistant_message]]
-        return "", new_history
+        if cache_key:
+            response_cache.put(cache_key, new_history[-1][1])
+        if compact:
+            conversation_summarizer.schedule(new_history, model)
         
     except Exception as e:
         print(f"Error in chat_wrapper: {str(e)}")
         error_message = f"Error: {str(e)}\nPlease ensure a model is selected and Ollama is running."
-        new_history = history + [[message, error_message]] if history is not None else [[message, error_message]]
-        return "", new_history
+        new_history = (history or []) + [[message, error_message]]
+        yield "", new_history, gr.update()
 
 def refresh_project_list():
     """Refresh the list of available projects"""
     try:
-        projects = list_projects()
+        projects = project_choices()
         return gr.Dropdown(choices=projects, value=None)
     except Exception as e:
         print(f"Error refreshing project list: {e}")
         return gr.Dropdown(choices=[], value=None)
 
-def save_chat_project(name, history, system_inst, file_cont):
-    """Save the chat history, system instructions, and file content to a JSON file"""
-    if not name:
-        return gr.update(), history, gr.update(), system_inst, file_cont
-    try:
-        os.makedirs("projects", exist_ok=True)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def turn_hash(user_msg, assistant_msg):
+    """Hash of one history turn, used to find where a saved history diverges"""
+    return content_hash(json.dumps([user_msg, assistant_msg], ensure_ascii=False))
+
+class ProjectStore:
+    """SQLite-backed storage for chat projects.
+
+    Each history turn is its own row, so saving a project only writes the
+    turns that changed since the last save, and project metadata can be
+    queried without reading message bodies. The database runs in WAL mode
+    so readers never block the writer. Legacy projects/<name>.json files are
+    imported on first open and renamed to <name>.json.migrated.
+
+    Document text is stored once per distinct content in a zlib-compressed,
+    reference-counted blobs table; projects refer to it by hash and a blob is
+    deleted when the last project using it goes away.
+
+    Turns and system instructions are also indexed in an FTS5 table for
+    ranked full-text search. Index rows are keyed on the id of their source
+    row (message id for a turn, negated project id for the system
+    instruction), so saves and deletes update the index in step with the
+    turns they write. Both ids are declared INTEGER PRIMARY KEY, so unlike
+    an implicit rowid they survive VACUUM unchanged.
+    """
+    
+    # Decompressed documents kept in memory, most recently used last
+    document_cache_size = 16
+    
+    # Column definitions shared by table creation and the id migration
+    TABLE_COLUMNS = {
+        "projects": """
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            timestamp TEXT NOT NULL,
+            system_instruction TEXT NOT NULL DEFAULT '',
+            file_content TEXT NOT NULL DEFAULT '',
+            file_hash TEXT NOT NULL DEFAULT '',
+            turn_count INTEGER NOT NULL DEFAULT 0,
+            model TEXT NOT NULL DEFAULT '',
+            updated_at REAL NOT NULL DEFAULT 0,
+            summary TEXT NOT NULL DEFAULT '',
+            summary_turns INTEGER NOT NULL DEFAULT 0,
+            summary_hash TEXT NOT NULL DEFAULT ''
+        """,
+        "messages": """
+            id INTEGER PRIMARY KEY,
+            project TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            turn_hash TEXT NOT NULL,
+            user_message TEXT,
+            assistant_message TEXT,
+            UNIQUE (project, position)
+        """,
+    }
+    
+    def __init__(self, path=PROJECTS_DB, legacy_dir=PROJECTS_DIR):
+        self.path = path
+        self.legacy_dir = legacy_dir
+        self._documents = OrderedDict()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for table, columns in self.TABLE_COLUMNS.items():
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        # Databases created before the metadata columns existed need them added
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(projects)")}
+        if "model" not in columns:
+            self._conn.execute("ALTER TABLE projects ADD COLUMN model TEXT NOT NULL DEFAULT ''")
+        if "updated_at" not in columns:
+            self._conn.execute("ALTER TABLE projects ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+        if "summary" not in columns:
+            self._conn.execute("ALTER TABLE projects ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+            self._conn.execute("ALTER TABLE projects ADD COLUMN summary_turns INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("ALTER TABLE projects ADD COLUMN summary_hash TEXT NOT NULL DEFAULT ''")
+        self.migrate_integer_ids()
+        self._conn.execute("CREATE INDEX IF NOT EXISTS projects_updated_at ON projects (updated_at)")
+        self.search_enabled = True
+        index_exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'project_search'"
+        ).fetchone() is not None
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS project_search USING fts5("
+                "content, project UNINDEXED, position UNINDEXED, tokenize = 'porter unicode61')"
+            )
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5; searching falls back to a slow LIKE scan
+            print(f"Full-text search unavailable, falling back to plain matching: {e}")
+            self.search_enabled = False
+        self._conn.commit()
+        if self.search_enabled and not index_exists:
+            self.rebuild_search_index()
+        self.migrate_inline_documents()
+        self.migrate_json_projects()
+    
+    def migrate_integer_ids(self):
+        """Give tables created before the id columns existed an explicit INTEGER PRIMARY KEY.
+
+        Each table is copied with id = its old rowid, so search index rows
+        built from those rowids still point at the same turns.
+        """
+        for table, columns in self.TABLE_COLUMNS.items():
+            existing = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+            if "id" in existing:
+                continue
+            names = ", ".join(existing)
+            self._conn.executescript(f"""
+                BEGIN;
+                CREATE TABLE {table}_migrated ({columns});
+                INSERT INTO {table}_migrated (id, {names}) SELECT rowid, {names} FROM {table};
+                DROP TABLE {table};
+                ALTER TABLE {table}_migrated RENAME TO {table};
+                COMMIT;
+            """)
+            print(f"Added stable ids to the {table} table")
+    
+    def migrate_inline_documents(self):
+        """Move document text stored directly on project rows into the blob store"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT name, file_content FROM projects WHERE file_content != ''"
+            ).fetchall()
+            for name, file_content in rows:
+                file_hash = self._put_blob(file_content)
+                self._conn.execute(
+                    "UPDATE projects SET file_content = '', file_hash = ? WHERE name = ?", (file_hash, name)
+                )
+    
+    def _put_blob(self, content):
+        """Add a reference to content, storing it if new; returns its hash ('' for no content).
+
+        content may be a DocumentRef to a stored blob, which only gains a
+        reference. If every project using that blob has since been deleted,
+        the text is stored again from the document cache ('' if it has been
+        evicted from there too). Caller holds the lock.
+        """
+        if not content:
+            return ""
+        if isinstance(content, DocumentRef):
+            updated = self._conn.execute(
+                "UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?", (content.file_hash,)
+            ).rowcount
+            if updated:
+                return content.file_hash
+            text = self._documents.get(content.file_hash)
+            if text is None:
+                print(f"Document {content.file_hash[:12]} is no longer stored; saving without it")
+                return ""
+            content = text
+        blob_hash = content_hash(content)
+        updated = self._conn.execute(
+            "UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?", (blob_hash,)
+        ).rowcount
+        if not updated:
+            self._conn.execute(
+                "INSERT INTO blobs (hash, data, size, refcount) VALUES (?, ?, ?, 1)",
+                (blob_hash, zlib.compress(content.encode('utf-8'), 6), len(content))
+            )
+        return blob_hash
+    
+    def _release_blob(self, blob_hash):
+        """Drop a reference to a blob, deleting it once nothing uses it (caller holds the lock).
+
+        A deleted document stays in the document cache, so sessions still
+        holding a DocumentRef to it can keep chatting and save it again.
+        """
+        if not blob_hash:
+            return
+        self._conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?", (blob_hash,))
+        row = self._conn.execute(
+            "SELECT data FROM blobs WHERE hash = ? AND refcount <= 0", (blob_hash,)
+        ).fetchone()
+        if row is not None:
+            if blob_hash not in self._documents:
+                self._cache_document(blob_hash, zlib.decompress(row[0]).decode('utf-8'))
+            self._conn.execute("DELETE FROM blobs WHERE hash = ?", (blob_hash,))
+    
+    def _cache_document(self, blob_hash, text):
+        """Remember decompressed text, evicting the least recently used (caller holds the lock)"""
+        self._documents[blob_hash] = text
+        self._documents.move_to_end(blob_hash)
+        while len(self._documents) > self.document_cache_size:
+            self._documents.popitem(last=False)
+    
+    def load_document(self, blob_hash):
+        """Decompress a document blob; recently used documents stay cached in memory"""
+        if not blob_hash:
+            return ""
+        with self._lock:
+            text = self._documents.get(blob_hash)
+            if text is not None:
+                self._documents.move_to_end(blob_hash)
+                return text
+            row = self._conn.execute("SELECT data FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()
+        if row is None:
+            return ""
+        text = zlib.decompress(row[0]).decode('utf-8')
+        with self._lock:
+            self._cache_document(blob_hash, text)
+        return text
+    
+    def clear_document_cache(self):
+        with self._lock:
+            self._documents.clear()
+    
+    def migrate_json_projects(self):
+        """Import legacy JSON project files that aren't in the database yet"""
+        if not os.path.isdir(self.legacy_dir):
+            return
+        for filename in os.listdir(self.legacy_dir):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(self.legacy_dir, filename)
+            name = filename[:-len(".json")]
+            try:
+                with open(path, "r", encoding='utf-8') as f:
+                    data = json.load(f)
+                if not self.exists(name):
+                    self.save(
+                        name,
+                        data.get("history") or [],
+                        data.get("system_instruction") or "",
+                        data.get("file_content") or "",
+                        timestamp=data.get("timestamp")
+                    )
+                os.replace(path, f"{path}.migrated")
+                print(f"Migrated project {name} to {self.path}")
+            except Exception as e:
+                print(f"Error migrating project {name}: {e}")
+    
+    def exists(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM projects WHERE name = ?", (name,)).fetchone()
+        return row is not None
+    
+    def save(self, name, history, system_instruction, file_content, timestamp=None, model=None, summary=None):
+        """Write a project, appending only the turns that differ from the saved copy.
+
+        summary, if given, is a conversation summary dict (text, turns,
+        prefix_hash) stored alongside the history.
+        """
+        timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            updated_at = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp()
+        except ValueError:
+            updated_at = time.time()
+        turns = [(turn[0], turn[1]) for turn in (history or [])]
+        hashes = [turn_hash(user_msg, assistant_msg) for user_msg, assistant_msg in turns]
+        file_content = file_content or ""
+        file_hash = document_hash(file_content) if file_content else ""
         
-        # Ensure file_cont is properly handled even if it's None
-        save_data = {
-            "history": history,
-            "timestamp": timestamp,
+        with self._lock, self._conn:
+            saved_hashes = [row[0] for row in self._conn.execute(
+                "SELECT turn_hash FROM messages WHERE project = ? ORDER BY position", (name,)
+            )]
+            # Keep the longest unchanged prefix; rewrite everything after it
+            unchanged = 0
+            for saved, current in zip(saved_hashes, hashes):
+                if saved != current:
+                    break
+                unchanged += 1
+            if unchanged < len(saved_hashes):
+                self._unindex_turns(name, unchanged)
+                self._conn.execute(
+                    "DELETE FROM messages WHERE project = ? AND position >= ?", (name, unchanged)
+                )
+            self._conn.executemany(
+                "INSERT INTO messages (project, position, turn_hash, user_message, assistant_message) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(name, position, hashes[position], *turns[position])
+                 for position in range(unchanged, len(turns))]
+            )
+            self._index_turns(name, unchanged)
+            
+            row = self._conn.execute("SELECT file_hash FROM projects WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                file_hash = self._put_blob(file_content)
+                self._conn.execute(
+                    "INSERT INTO projects (name, timestamp, system_instruction, file_hash, turn_count, model, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (name, timestamp, system_instruction or "", file_hash, len(turns), model or "", updated_at)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE projects SET timestamp = ?, system_instruction = ?, turn_count = ?, "
+                    "model = COALESCE(NULLIF(?, ''), model), updated_at = ? WHERE name = ?",
+                    (timestamp, system_instruction or "", len(turns), model or "", updated_at, name)
+                )
+                # The document is usually unchanged between saves; only touch blobs when it differs
+                if row[0] != file_hash:
+                    file_hash = self._put_blob(file_content)
+                    self._release_blob(row[0])
+                    self._conn.execute(
+                        "UPDATE projects SET file_hash = ? WHERE name = ?", (file_hash, name)
+                    )
+            if summary:
+                self._conn.execute(
+                    "UPDATE projects SET summary = ?, summary_turns = ?, summary_hash = ? WHERE name = ?",
+                    (summary["text"], summary["turns"], summary["prefix_hash"], name)
+                )
+            self._index_system_instruction(name, system_instruction)
+        return len(turns) - unchanged
+    
+    def _unindex_turns(self, name, start):
+        """Remove index rows for a project's turns from position start on (caller holds the lock)"""
+        if not self.search_enabled:
+            return
+        self._conn.execute(
+            "DELETE FROM project_search WHERE rowid IN "
+            "(SELECT id FROM messages WHERE project = ? AND position >= ?)", (name, start)
+        )
+    
+    def _index_turns(self, name, start):
+        if not self.search_enabled:
+            return
+        self._conn.execute(
+            "INSERT INTO project_search (rowid, content, project, position) "
+            "SELECT id, COALESCE(user_message, '') || char(10) || COALESCE(assistant_message, ''), "
+            "project, position FROM messages WHERE project = ? AND position >= ?", (name, start)
+        )
+    
+    def _index_system_instruction(self, name, system_instruction):
+        if not self.search_enabled:
+            return
+        self._conn.execute(
+            "DELETE FROM project_search WHERE rowid = -(SELECT id FROM projects WHERE name = ?)", (name,)
+        )
+        if system_instruction:
+            self._conn.execute(
+                "INSERT INTO project_search (rowid, content, project, position) "
+                "SELECT -id, ?, name, -1 FROM projects WHERE name = ?", (system_instruction, name)
+            )
+    
+    def rebuild_search_index(self):
+        """Re-create the full-text index from the stored projects.
+
+        Index rowids are messages.id and -projects.id; both are explicit
+        INTEGER PRIMARY KEY columns, so they stay valid across VACUUM.
+        """
+        if not self.search_enabled:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM project_search")
+            self._conn.execute(
+                "INSERT INTO project_search (rowid, content, project, position) "
+                "SELECT id, COALESCE(user_message, '') || char(10) || COALESCE(assistant_message, ''), "
+                "project, position FROM messages"
+            )
+            self._conn.execute(
+                "INSERT INTO project_search (rowid, content, project, position) "
+                "SELECT -id, system_instruction, name, -1 FROM projects WHERE system_instruction != ''"
+            )
+    
+    def search(self, query, limit=PROJECT_SEARCH_LIMIT):
+        """Rank projects by BM25 relevance to query.
+
+        Returns one hit per project, best first, as dicts with the project
+        name, the position of its best-matching turn (-1 for the system
+        instruction), a highlighted snippet and the number of matching rows.
+        """
+        tokens = re.findall(r"\w+", (query or "").lower())
+        if not tokens:
+            return []
+        with self._lock:
+            if self.search_enabled:
+                # Quote every token so user input can't form FTS syntax; * makes each a prefix match
+                match = " ".join(f'"{token}"*' for token in tokens)
+                # Best row and match count per project are found in SQL, so a project with
+                # many matching turns can't crowd the others out of the results
+                best = self._conn.execute(
+                    "SELECT row, project, position, matches FROM ("
+                    " SELECT rowid AS row, project, position, score,"
+                    " ROW_NUMBER() OVER (PARTITION BY project ORDER BY score) AS best,"
+                    " COUNT(*) OVER (PARTITION BY project) AS matches"
+                    " FROM (SELECT rowid, project, position, rank AS score"
+                    " FROM project_search WHERE project_search MATCH ?)"
+                    ") WHERE best = 1 ORDER BY score LIMIT ?",
+                    (match, limit)
+                ).fetchall()
+                # Snippets are only built for the rows that made the cut
+                snippets = dict(self._conn.execute(
+                    "SELECT rowid, snippet(project_search, 0, '**', '**', ' … ', 16) FROM project_search "
+                    f"WHERE project_search MATCH ? AND rowid IN ({','.join('?' * len(best))})",
+                    (match, *(row for row, _, _, _ in best))
+                )) if best else {}
+                rows = [(project, position, snippets.get(row, ""), matches)
+                        for row, project, position, matches in best]
+            else:
+                pattern = f"%{tokens[0]}%"
+                rows = self._conn.execute(
+                    "SELECT project, MIN(position), substr(COALESCE(user_message, '') || ' ' || "
+                    "COALESCE(assistant_message, ''), 1, 160), COUNT(*) FROM messages "
+                    "WHERE user_message LIKE ? OR assistant_message LIKE ? "
+                    "GROUP BY project ORDER BY COUNT(*) DESC LIMIT ?",
+                    (pattern, pattern, limit)
+                ).fetchall()
+        return [
+            {"project": project, "position": position, "snippet": snippet, "matches": matches}
+            for project, position, snippet, matches in rows
+        ]
+    
+    def load(self, name):
+        """Return the saved project as a dict, or None if it doesn't exist.
+
+        The document itself isn't decompressed here; pass the returned
+        file_hash to load_document() when the text is actually needed.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT timestamp, system_instruction, file_hash, model, summary, summary_turns, summary_hash "
+                "FROM projects WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                return None
+            history = [[user_msg, assistant_msg] for user_msg, assistant_msg in self._conn.execute(
+                "SELECT user_message, assistant_message FROM messages WHERE project = ? ORDER BY position",
+                (name,)
+            )]
+        return {
             "name": name,
-            "system_instruction": system_inst,
-            "file_content": file_cont if file_cont is not None else ""
+            "timestamp": row[0],
+            "system_instruction": row[1],
+            "file_hash": row[2],
+            "model": row[3],
+            "summary": {"text": row[4], "turns": row[5], "prefix_hash": row[6]} if row[5] else None,
+            "history": history
         }
+    
+    def list_metadata(self, prefix="", sort_by="name"):
+        """Return project metadata dicts, optionally filtered by name prefix.
+
+        Reads only the projects table; message bodies and documents are never
+        touched. sort_by is "name" or "updated" (most recently saved first).
+        """
+        query = "SELECT name, timestamp, turn_count, model FROM projects"
+        params = ()
+        if prefix:
+            # Range scan on the primary key instead of LIKE, so it stays indexed
+            query += " WHERE name >= ? AND name < ?"
+            params = (prefix, prefix + "\U0010ffff")
+        query += " ORDER BY updated_at DESC" if sort_by == "updated" else " ORDER BY name"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {"name": name, "timestamp": timestamp, "turn_count": turn_count, "model": model}
+            for name, timestamp, turn_count, model in rows
+        ]
+    
+    def list_names(self, prefix="", sort_by="name"):
+        return [meta["name"] for meta in self.list_metadata(prefix, sort_by)]
+    
+    def rebuild_metadata(self):
+        """Recompute turn counts and sort keys from the stored rows"""
+        with self._lock, self._conn:
+            self._conn.execute("""
+                UPDATE projects SET turn_count = (
+                    SELECT COUNT(*) FROM messages WHERE messages.project = projects.name
+                )
+            """)
+            for name, timestamp in self._conn.execute("SELECT name, timestamp FROM projects").fetchall():
+                try:
+                    updated_at = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp()
+                except (TypeError, ValueError):
+                    continue
+                self._conn.execute("UPDATE projects SET updated_at = ? WHERE name = ?", (updated_at, name))
+    
+    def delete(self, name):
+        """Delete a project; returns False if it didn't exist"""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT file_hash FROM projects WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return False
+            self._unindex_turns(name, 0)
+            self._index_system_instruction(name, "")
+            self._conn.execute("DELETE FROM messages WHERE project = ?", (name,))
+            self._conn.execute("DELETE FROM projects WHERE name = ?", (name,))
+            self._release_blob(row[0])
+        return True
+
+_project_store = None
+_project_store_lock = threading.Lock()
+
+def get_project_store():
+    """Open the shared project store on first use"""
+    global _project_store
+    with _project_store_lock:
+        if _project_store is None:
+            _project_store = ProjectStore()
+        return _project_store
+
+def save_chat_project(name, history, system_inst, file_cont, model=None):
+    """Save the chat history, system instructions, and file content to the project store"""
+    if not name:
+        return gr.update(), history, gr.update(), system_inst, file_cont
+    try:
+        summary = conversation_summarizer.best(history) if history else None
+        written = get_project_store().save(name, history, system_inst, file_cont, model=model, summary=summary)
         
-        with open(f"projects/{name}.json", "w", encoding='utf-8') as f:
-            json.dump(save_data, f, ensure_ascii=False, indent=2)
-        
-        print(f"Project saved successfully: {name}")  # Debug print
-        print(f"Saved file content length: {len(str(file_cont)) if file_cont else 0}")  # Debug print
+        print(f"Project saved successfully: {name} ({written} turns written)")  # Debug print
+        print(f"Saved document: {document_hash(file_cont)[:12] if file_cont else 'none'}")  # Debug print
         
         return gr.update(), history, refresh_project_list(), system_inst, file_cont
     except Exception as e:
         print(f"Error saving project: {e}")  # Log error instead of showing it
         return gr.update(), history, gr.update(), system_inst, file_cont
 
+def read_chat_project(name):
+    """Return (history, system_instruction, file_content, model) for a project, or None.
+
+    file_content is a DocumentRef (or "" without a document); the text is
+    only decompressed when a turn, prefill or index build resolves it.
+    """
+    data = get_project_store().load(name)
+    if data is None:
+        return None
+    file_cont = DocumentRef(data["file_hash"]) if data["file_hash"] else ""
+    conversation_summarizer.restore(data["history"], data.get("summary"))
+    return data["history"], data["system_instruction"], file_cont, data.get("model") or ""
+
 def load_chat_project(name):
-    """Load a chat history from a JSON file"""
+    """Load a chat history from the project store"""
     if not name:
         return gr.update(), None, "", ""
     try:
-        with open(f"projects/{name}.json", "r", encoding='utf-8') as f:
-            data = json.load(f)
+        project = read_chat_project(name)
+        if project is None:
+            return gr.update(), None, "", ""
         
-        history = data.get("history", [])
-        system_inst = data.get("system_instruction", "")
-        file_cont = data.get("file_content", "")
+        history, system_inst, file_cont, _ = project
         
         print(f"Loading project: {name}")
         print(f"Loaded system instruction length: {len(system_inst)}")
-        print(f"Loaded file content length: {len(file_cont)}")
+        print(f"Loaded document: {file_cont.file_hash[:12] if file_cont else 'none'}")
         
         return gr.update(), history, system_inst, file_cont
-    except FileNotFoundError:
-        return gr.update(), None, "", ""
     except Exception as e:
         print(f"Error loading project: {e}")
         return gr.update(), None, "", ""
 
-def list_projects():
+def list_projects(prefix="", sort_by="name"):
     """List all available projects"""
     try:
-        if not os.path.exists("projects"):
-            return []
-        return [f.replace(".json", "") for f in os.listdir("projects") if f.endswith(".json")]
-    except Exception:
+        return get_project_store().list_names(prefix, sort_by)
+    except Exception as e:
+        print(f"Error listing projects: {e}")
+        return []
+
+def project_choices(prefix="", sort_by="name"):
+    """Dropdown choices for saved projects, labelled with their metadata"""
+    try:
+        choices = []
+        for meta in get_project_store().list_metadata(prefix, sort_by):
+            details = [meta["timestamp"], f"{meta['turn_count']} turns"]
+            if meta["model"]:
+                details.append(meta["model"])
+            choices.append((f"{meta['name']} ({', '.join(details)})", meta["name"]))
+        return choices
+    except Exception as e:
+        print(f"Error listing projects: {e}")
         return []
 
-def update_project_list():
+def update_project_list(prefix="", sort_order="Name", rebuild=False):
     """Update the list of available projects"""
     try:
-        projects = list_projects()
+        if rebuild:
+            get_project_store().rebuild_metadata()
+        sort_by = "updated" if sort_order == "Last modified" else "name"
+        projects = project_choices(prefix.strip() if prefix else "", sort_by)
         return gr.Dropdown(choices=projects)
     except Exception as e:
         print(f"Error updating project list: {e}")
         return gr.Dropdown(choices=[])
 
-def delete_chat_project(name):
+def search_projects(query):
+    """Rows of ranked full-text hits across saved projects"""
+    if not query or not query.strip():
+        return []
+    try:
+        return [
+            [hit["project"], "System instruction" if hit["position"] < 0 else f"Turn {hit['position'] + 1}",
+             hit["matches"], hit["snippet"].replace("\n", " ")]
+            for hit in get_project_store().search(query)
+        ]
+    except Exception as e:
+        print(f"Error searching projects: {e}")
+        return []
+
+def rebuild_project_search(query):
+    """Re-create the full-text index from the stored projects, then rerun the current search"""
+    try:
+        start_time = time.perf_counter()
+        get_project_store().rebuild_search_index()
+        print(f"Rebuilt project search index in {time.perf_counter() - start_time:.2f}s")
+    except Exception as e:
+        print(f"Error rebuilding project search index: {e}")
+    return search_projects(query)
+
+async def debounced_search_projects(query):
+    """Search after a short pause, so a burst of keystrokes runs one search"""
+    await asyncio.sleep(PROJECT_SEARCH_DEBOUNCE)
+    return await asyncio.to_thread(search_projects, query)
+
+def select_search_hit(evt: "gr.SelectData", results):
+    """Put the clicked hit's project in the project name box, ready to load"""
+    rows = results.values.tolist() if hasattr(results, 'values') else results
+    if not evt or not hasattr(evt, 'index') or not rows:
+        return gr.update()
+    return rows[evt.index[0]][0]
+
+def delete_chat_project(name, file_cont=""):
     """Delete a chat project"""
     if not name:
-        return gr.update(), gr.update()
+        return gr.update(), gr.update(), file_cont
     try:
-        project_path = f"projects/{name}.json"
-        if os.path.exists(project_path):
-            os.remove(project_path)
+        # The session may still refer to this project's document; keep the text itself
+        # so it survives the blob being deleted along with its last project
+        file_cont = resolve_document(file_cont)
+        if get_project_store().delete(name):
             # Clear the project name and update dropdown without message
-            return gr.update(value=""), refresh_project_list()
+            return gr.update(value=""), refresh_project_list(), file_cont
         else:
             print(f"Project '{name}' not found")  # Log error instead of showing it
-            return gr.update(), gr.update()
+            return gr.update(), gr.update(), file_cont
     except Exception as e:
         print(f"Error deleting project: {e}")  # Log error instead of showing it
-        return gr.update(), gr.update()
+        return gr.update(), gr.update(), file_cont
+
+def report_startup_timings():
+    """Print startup phase timings and append them to STARTUP_LOG if configured"""
+    summary = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_timings.items())
+    print(f"Startup timings: {summary}")
+    if STARTUP_LOG:
+        try:
+            with open(STARTUP_LOG, 'a', encoding='utf-8') as f:
+                record = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **startup_timings}
+                f.write(json.dumps(record) + "\n")
+        except Exception as e:
+            print(f"Couldn't write startup log: {e}")
+
+def populate_ui():
+    """Fill model and project lists once the page has loaded"""
+    installed_models = list(get_installed_models().keys())
+    models = fetch_available_models()
+    if "first_paint" not in startup_timings:
+        startup_timings["first_paint"] = time.perf_counter() - _MODULE_START
+        report_startup_timings()
+    return (
+        gr.Dropdown(choices=installed_models, value=installed_models[0] if installed_models else None),
+        gr.Dropdown(choices=get_model_categories(models), value="All"),
+        models,
+        gr.Dropdown(choices=project_choices())
+    )
+
+def refresh_backend_status():
+    """Probe every Ollama host now and return rows for the hosts table"""
+    backend_pool.probe_all()
+    return backend_pool.status_rows()
+
+def refresh_performance_tables():
+    """Rows for the per-model and recent-turn tables in the Performance tab"""
+    def seconds(value):
+        return f"{value:.2f}s" if value is not None else "-"
+    
+    def rate(value):
+        return f"{value:.1f}" if value is not None else "-"
+    
+    model_rows = [
+        [
+            model,
+            stats["turns"],
+            seconds(stats["latency_p50"]),
+            seconds(stats["latency_p95"]),
+            seconds(stats["ttft_p50"]),
+            seconds(stats["ttft_p95"]),
+            rate(stats["tokens_per_second"]),
+            rate(stats["prompt_tokens_per_second"]),
+            f"{stats['load_share']:.0%}" if stats["load_share"] is not None else "-"
+        ]
+        for model, stats in sorted(inference_metrics.summary().items())
+    ]
+    turn_rows = [
+        [
+            turn["timestamp"],
+            turn["model"],
+            seconds(turn["time_to_first_token"]),
+            seconds(turn["total_time"]),
+            turn["prompt_eval_count"],
+            turn["eval_count"],
+            rate(turn["eval_count"] / (turn["eval_duration"] / 1e9)) if turn["eval_duration"] else "-",
+            seconds(turn["load_duration"] / 1e9)
+        ]
+        for turn in reversed(inference_metrics.recent())
+    ]
+    return model_rows, turn_rows
+
+def warm_model_catalog():
+    """Fetch model lists in the background so the first page load finds them cached"""
+    get_installed_models()
+    get_available_models()
+
+def read_batch_prompts(path):
+    """Prompts from a JSON-lines file as (id, prompt) pairs.
+
+    Each line is either a JSON string or an object with a "prompt" field and
+    an optional "id"; items without an id are numbered by line.
+    """
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                items.append((str(line_number), item))
+            else:
+                items.append((str(item.get("id", line_number)), item["prompt"]))
+    return items
+
+def finished_batch_ids(path):
+    """Ids already answered successfully in an earlier run's output"""
+    done = set()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run
+                    continue
+                if not result.get("error"):
+                    done.add(str(result["id"]))
+    except FileNotFoundError:
+        pass
+    return done
+
+async def run_batch(items, output_path, model, history, system, file_content, use_retrieval=False,
+                    concurrency=2, temperature=None, seed=None):
+    """Answer each (id, prompt) with bounded concurrency, appending results to output_path as they finish"""
+    doc_index = None
+    if use_retrieval and file_content:
+        doc_index = await asyncio.to_thread(build_document_index, file_content)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    completed = 0
+    failures = 0
+    
+    # Start on a fresh line if an interrupted run left a partial one behind
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+        if needs_newline:
+            with open(output_path, 'a', encoding='utf-8') as f:
+                f.write("\n")
+    
+    with open(output_path, 'a', encoding='utf-8') as output:
+        async def answer(item_id, prompt):
+            nonlocal completed, failures
+            async with semaphore:
+                start_time = time.perf_counter()
+                result = {"id": item_id, "prompt": prompt, "model": model}
+                try:
+                    ollama_messages, num_ctx, _ = await asyncio.to_thread(
+                        prepare_chat_request, prompt, history, model, system, file_content,
+                        use_retrieval, doc_index
+                    )
+                    response = ""
+                    async for response in stream_chat(model, ollama_messages,
+                                                      options=generation_options(num_ctx, temperature, seed)):
+                        pass
+                    result["response"] = response
+                except Exception as e:
+                    result["error"] = str(e)
+                    failures += 1
+                result["elapsed"] = round(time.perf_counter() - start_time, 3)
+                # One complete line per result, flushed at once, so an interrupted run loses nothing finished
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                completed += 1
+                status = f"error: {result['error']}" if "error" in result else f"{result['elapsed']:.1f}s"
+                print(f"[{completed}/{len(items)}] {item_id}: {status}")
+        
+        await asyncio.gather(*(answer(item_id, prompt) for item_id, prompt in items))
+    return completed, failures
+
+def batch_main(argv=None):
+    """Run prompts from a JSON-lines file against a saved project without the web UI"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="localgpt-batch",
+        description="Answer a file of prompts using a saved project's system instruction and document"
+    )
+    parser.add_argument("project", help="name of a saved project")
+    parser.add_argument("prompts", help="JSON-lines file of prompts (strings or {\"id\": ..., \"prompt\": ...})")
+    parser.add_argument("output", help="JSON-lines file results are appended to; rerun to resume")
+    parser.add_argument("--model", help="model to use (default: the model saved with the project)")
+    parser.add_argument("--concurrency", type=int, default=2, help="prompts in flight at once")
+    parser.add_argument("--retrieval", action="store_true", help="send only relevant document passages")
+    parser.add_argument("--with-history", action="store_true", help="include the project's chat history")
+    parser.add_argument("--temperature", type=float)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+    
+    project = read_chat_project(args.project)
+    if project is None:
+        parser.error(f"no saved project named {args.project!r}")
+    history, system_inst, file_cont, saved_model = project
+    model = args.model or saved_model
+    if not model:
+        parser.error("the project has no saved model; pass --model")
+    
+    items = read_batch_prompts(args.prompts)
+    done = finished_batch_ids(args.output)
+    pending = [(item_id, prompt) for item_id, prompt in items if item_id not in done]
+    print(f"{len(items)} prompts, {len(items) - len(pending)} already done, running {len(pending)} on {model}")
+    if not pending:
+        return 0
+    
+    backend_pool.probe_all()
+    start_time = time.perf_counter()
+    completed, failures = asyncio.run(run_batch(
+        pending, args.output, model,
+        history if args.with_history else [],
+        system_inst or "You are a helpful AI assistant.",
+        file_cont, args.retrieval, args.concurrency, args.temperature, args.seed
+    ))
+    print(f"Finished {completed} prompts in {format_time(time.perf_counter() - start_time)} "
+          f"({failures} failed; rerun the same command to retry them)")
+    return 1 if failures else 0
 
 def main():
+    # Touch gradio explicitly so its import cost is reported separately from the UI build
+    import_start = time.perf_counter()
+    gr.Blocks
+    startup_timings["gradio_import"] = time.perf_counter() - import_start
+    
+    ui_start = time.perf_counter()
+    if DEFERRED_STARTUP:
+        installed_models, initial_models, initial_projects = [], [], []
+    else:
+        installed_models = list(get_installed_models().keys())
+        initial_models = fetch_available_models()
+        initial_projects = project_choices()
+    
     with gr.Blocks(title="LocalGPT", theme=gr.themes.Soft()) as demo:
         # Initialize file content state with empty string
         file_content = gr.State("")
+        # Per-session vector index over the current document (retrieval mode)
+        doc_index = gr.State(None)
         
         with gr.Tabs() as tabs:
             # Chat Tab
@@ -527,8 +3498,20 @@ def main():
                             placeholder="Enter project name...",
                             container=False
                         )
+                        with gr.Row():
+                            project_filter = gr.Textbox(
+                                placeholder="Filter projects by name...",
+                                container=False,
+                                scale=3
+                            )
+                            project_sort = gr.Radio(
+                                choices=["Name", "Last modified"],
+                                value="Name",
+                                container=False,
+                                scale=2
+                            )
                         available_projects = gr.Dropdown(
-                            choices=list_projects(),
+                            choices=initial_projects,
                             label="Available Projects",
                             container=False
                         )
@@ -537,6 +3520,20 @@ def main():
                             load_project = gr.Button("Load Project")
                             delete_project = gr.Button("🗑️ Delete Project", variant="secondary")
                             refresh_projects = gr.Button("🔄 Refresh")
+                        with gr.Row():
+                            project_search = gr.Textbox(
+                                placeholder="Search all saved conversations...",
+                                container=False,
+                                scale=4
+                            )
+                            # Saves keep the index current; this is only for repairing it
+                            rebuild_search = gr.Button("Rebuild Search Index", size="sm", scale=1)
+                        project_search_results = gr.Dataframe(
+                            headers=["Project", "Best Match", "Matches", "Snippet"],
+                            datatype=["str", "str", "number", "str"],
+                            interactive=False,
+                            wrap=True
+                        )
                 
                 # Chat Interface Row
                 with gr.Row(equal_height=True):
@@ -563,9 +3560,9 @@ def main():
                     # Controls on the right (narrower)
                     with gr.Column(scale=1):
                         model_dropdown = gr.Dropdown(
-                            choices=list(get_installed_models().keys()),
+                            choices=installed_models,
                             label="Select Model",
-                            value=list(get_installed_models().keys())[0] if get_installed_models() else None,
+                            value=installed_models[0] if installed_models else None,
                             container=False
                         )
                         system_instruction = gr.Textbox(
@@ -582,6 +3579,34 @@ def main():
                             type="filepath"
                         )
 
+                        retrieval_mode = gr.Checkbox(
+                            label="Retrieval mode (send only relevant passages)",
+                            value=False
+                        )
+                        
+                        with gr.Accordion("Generation Settings", open=False):
+                            # Left empty, the model's own default temperature applies
+                            temperature = gr.Number(
+                                label="Temperature (empty = model default)",
+                                minimum=0.0,
+                                maximum=2.0,
+                                step=0.05,
+                                value=None
+                            )
+                            seed = gr.Number(
+                                label="Seed (0 = random)",
+                                value=0,
+                                precision=0
+                            )
+                            use_response_cache = gr.Checkbox(
+                                label="Cache answers (only with temperature 0 or a fixed seed)",
+                                value=False
+                            )
+                            compact_history = gr.Checkbox(
+                                label="Compact long conversations (summarize older turns in the background)",
+                                value=COMPACTION_DEFAULT
+                            )
+
                         # Add file status display
                         file_status = gr.Textbox(
                             label="File Status",
@@ -589,6 +3614,13 @@ def main():
                             container=True
                         )
 
+                        context_usage = gr.Textbox(
+                            label="Context Usage",
+                            interactive=False,
+                            container=True,
+                            lines=3
+                        )
+
                         # Add system instruction status
                         system_status = gr.Markdown("""
                         💡 **Tip:** Use system instructions to guide the AI's behavior. 
@@ -607,7 +3639,7 @@ def main():
                                 container=False
                             )
                             category_filter = gr.Dropdown(
-                                choices=get_model_categories(fetch_available_models()),
+                                choices=get_model_categories(initial_models),
                                 label="Category",
                                 value="All",
                                 container=False
@@ -621,53 +3653,119 @@ def main():
                             autoscroll=True
                         )
                         
+                        with gr.Accordion("Downloads", open=True):
+                            downloads_table = gr.Dataframe(
+                                headers=["Model", "Host", "Status", "Progress", "Rate", "ETA", "Action"],
+                                datatype=["str", "str", "str", "str", "str", "str", "str"],
+                                interactive=False,
+                                wrap=True
+                            )
+                            clear_downloads_btn = gr.Button("Clear Finished", size="sm")
+                            downloads_seen = gr.State(0)
+                        
                         models_table = gr.Dataframe(
                             headers=["Name", "Category", "Size", "Description", "Status", "Last Updated", "Action"],
                             datatype=["str", "str", "str", "str", "str", "str", "str"],
                             interactive=False,
                             row_count=25,
                             wrap=True,
-                            value=fetch_available_models()
+                            value=initial_models
+                        )
+                        
+                        backends_table = gr.Dataframe(
+                            label="Ollama Hosts",
+                            headers=["Host", "Status", "Latency", "Active Requests", "Loaded Models", "Installed Models"],
+                            datatype=["str", "str", "str", "number", "str", "str"],
+                            interactive=False,
+                            wrap=True
                         )
                         
                         gr.Markdown("""
                         ### Instructions
                         1. Click on any model row to install or remove it
-                        2. Watch the status area for progress
+                        2. Watch the Downloads table for progress; click a download to cancel or resume it
                         3. Refresh the list to see updates
                         4. Search or filter to find specific models
                         """)
+            
+            # Performance Tab
+            with gr.Tab("Performance"):
+                perf_refresh_btn = gr.Button("Refresh", variant="primary")
+                model_metrics_table = gr.Dataframe(
+                    label="Per-Model Metrics",
+                    headers=["Model", "Turns", "p50 Latency", "p95 Latency", "p50 First Token",
+                             "p95 First Token", "Gen tok/s", "Prompt tok/s", "Load Share"],
+                    datatype=["str", "number", "str", "str", "str", "str", "str", "str", "str"],
+                    interactive=False,
+                    wrap=True
+                )
+                recent_turns_table = gr.Dataframe(
+                    label="Recent Turns",
+                    headers=["Time", "Model", "First Token", "Total", "Prompt Tokens",
+                             "Generated Tokens", "Gen tok/s", "Load Time"],
+                    datatype=["str", "str", "str", "str", "number", "number", "str", "str"],
+                    interactive=False,
+                    wrap=True
+                )
+                if METRICS_PORT:
+                    gr.Markdown(f"Prometheus metrics are served at `http://127.0.0.1:{METRICS_PORT}/metrics`.")
 
         # Update file upload handler
         def safe_process_file(file_path):
-            """Wrapper to safely process file and update state"""
+            """Wrapper to safely process file and update state, reporting progress"""
             if file_path is None:
-                return None
+                yield None, ""
+                return
             try:
-                new_content = process_file(file_path)
-                print(f"Updating file content state with length: {len(new_content) if new_content else 0}")
-                return new_content
+                for new_content, status in process_file_with_progress(file_path):
+                    if new_content is None:
+                        yield gr.update(), status
+                    else:
+                        print(f"Updating file content state with length: {len(new_content)}")
+                        yield new_content, status
             except Exception as e:
                 print(f"Error in safe_process_file: {e}")
-                return None
+                yield None, f"❌ Couldn't read file: {e}"
         
         file_upload.change(
             fn=safe_process_file,
             inputs=[file_upload],
-            outputs=[file_content]
+            outputs=[file_content, file_status]
+        ).then(
+            fn=start_prefill,
+            inputs=[file_content, model_dropdown, system_instruction, retrieval_mode]
+        ).then(
+            fn=update_document_index,
+            inputs=[file_content, retrieval_mode],
+            outputs=[doc_index, file_status]
+        )
+        
+        retrieval_mode.change(
+            fn=update_document_index,
+            inputs=[file_content, retrieval_mode],
+            outputs=[doc_index, file_status]
+        )
+        
+        # Start loading a newly chosen model before the first message is sent
+        model_dropdown.input(
+            fn=preload_selected_model,
+            inputs=[model_dropdown]
         )
         
         # Update chat events to include file content
         msg.submit(
             fn=chat_wrapper,
-            inputs=[msg, chatbot, model_dropdown, system_instruction, file_content],
-            outputs=[msg, chatbot]
+            inputs=[msg, chatbot, model_dropdown, system_instruction, file_content, retrieval_mode, doc_index,
+                    temperature, seed, use_response_cache, compact_history],
+            outputs=[msg, chatbot, context_usage],
+            api_name="chat"
         )
         
         submit.click(
             fn=chat_wrapper,
-            inputs=[msg, chatbot, model_dropdown, system_instruction, file_content],
-            outputs=[msg, chatbot]
+            inputs=[msg, chatbot, model_dropdown, system_instruction, file_content, retrieval_mode, doc_index,
+                    temperature, seed, use_response_cache, compact_history],
+            outputs=[msg, chatbot, context_usage]
         )
         
         clear.click(
@@ -678,7 +3776,7 @@ def main():
         # Project management events
         save_project.click(
             fn=save_chat_project,
-            inputs=[project_name, chatbot, system_instruction, file_content],
+            inputs=[project_name, chatbot, system_instruction, file_content, model_dropdown],
             outputs=[project_name, chatbot, available_projects, system_instruction, file_content]
         )
         
@@ -686,10 +3784,30 @@ def main():
             fn=load_chat_project,
             inputs=[project_name],
             outputs=[project_name, chatbot, system_instruction, file_content]
+        ).then(
+            fn=start_prefill,
+            inputs=[file_content, model_dropdown, system_instruction, retrieval_mode]
+        ).then(
+            fn=update_document_index,
+            inputs=[file_content, retrieval_mode],
+            outputs=[doc_index, file_status]
         )
         
         refresh_projects.click(
+            fn=lambda prefix, sort_order: update_project_list(prefix, sort_order, rebuild=True),
+            inputs=[project_filter, project_sort],
+            outputs=[available_projects]
+        )
+        
+        project_filter.change(
+            fn=update_project_list,
+            inputs=[project_filter, project_sort],
+            outputs=[available_projects]
+        )
+        
+        project_sort.change(
             fn=update_project_list,
+            inputs=[project_filter, project_sort],
             outputs=[available_projects]
         )
         
@@ -698,26 +3816,51 @@ def main():
             inputs=[available_projects],
             outputs=[project_name]
         )
+        
+        project_search.input(
+            fn=debounced_search_projects,
+            inputs=[project_search],
+            outputs=[project_search_results],
+            trigger_mode="always_last",
+            show_progress="hidden"
+        )
+        
+        rebuild_search.click(
+            fn=rebuild_project_search,
+            inputs=[project_search],
+            outputs=[project_search_results]
+        )
+        
+        project_search_results.select(
+            fn=select_search_hit,
+            inputs=[project_search_results],
+            outputs=[project_name]
+        )
 
         # Model management events
         refresh_btn.click(
             fn=refresh_models,
             outputs=[status_text, models_table, category_filter]
+        ).then(
+            fn=refresh_backend_status,
+            outputs=[backends_table]
         )
         
-        def on_filter_change(search, category, current_models):
-            return filter_models(search, category, current_models)
-
-        search_box.change(
-            fn=on_filter_change,
-            inputs=[search_box, category_filter, models_table],
-            outputs=[models_table]
+        # Search the full catalog server-side; only matching rows come back.
+        # always_last drops keystrokes that arrive while a search is pending.
+        search_box.input(
+            fn=debounced_search_models,
+            inputs=[search_box, category_filter],
+            outputs=[models_table],
+            trigger_mode="always_last",
+            show_progress="hidden"
         )
         
         category_filter.change(
-            fn=on_filter_change,
-            inputs=[search_box, category_filter, models_table],
-            outputs=[models_table]
+            fn=search_models,
+            inputs=[search_box, category_filter],
+            outputs=[models_table],
+            show_progress="hidden"
         )
 
         # Update model installation event
@@ -727,17 +3870,71 @@ def main():
             outputs=[status_text, models_table, model_dropdown]
         )
 
+        downloads_table.select(
+            fn=handle_download_action,
+            inputs=[downloads_table],
+            outputs=[status_text, downloads_table]
+        )
+        
+        clear_downloads_btn.click(
+            fn=clear_finished_downloads,
+            outputs=[downloads_table]
+        )
+
         # Add delete project event handler
         delete_project.click(
             fn=delete_chat_project,
-            inputs=[project_name],
-            outputs=[project_name, available_projects]
+            inputs=[project_name, file_content],
+            outputs=[project_name, available_projects, file_content]
         )
 
+        if DEFERRED_STARTUP:
+            demo.load(
+                fn=populate_ui,
+                outputs=[model_dropdown, category_filter, models_table, available_projects]
+            )
+        
+        demo.load(
+            fn=backend_pool.status_rows,
+            outputs=[backends_table]
+        )
+        
+        demo.load(
+            fn=poll_downloads,
+            inputs=[downloads_seen, search_box, category_filter],
+            outputs=[downloads_table, models_table, model_dropdown, downloads_seen],
+            every=DOWNLOAD_UI_INTERVAL
+        )
+        
+        perf_refresh_btn.click(
+            fn=refresh_performance_tables,
+            outputs=[model_metrics_table, recent_turns_table]
+        )
+        demo.load(
+            fn=refresh_performance_tables,
+            outputs=[model_metrics_table, recent_turns_table]
+        )
+    
+    startup_timings["ui_build"] = time.perf_counter() - ui_start
+    
+    launch_start = time.perf_counter()
+    demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY, max_size=GRADIO_MAX_QUEUE)
     demo.launch(
         height=750,
-        show_error=True
+        show_error=True,
+        prevent_thread_lock=True
     )
+    startup_timings["launch"] = time.perf_counter() - launch_start
+    report_startup_timings()
+    
+    backend_pool.start()
+    download_manager.start()
+    start_metrics_server()
+    if DEFERRED_STARTUP:
+        threading.Thread(target=warm_model_catalog, daemon=True).start()
+    demo.block_thread()
+
+startup_timings["import"] = time.perf_counter() - _MODULE_START
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,417 @@
+"""Micro-benchmarks for LocalGPT's hot paths.
+
+Runs entirely offline: Ollama is replaced by an in-process stub, and every
+database and cache is created in a scratch directory. Results are written
+as JSON so runs can be compared across commits:
+
+    python benchmark.py                       # all benchmarks
+    python benchmark.py --only chat files     # a subset
+    python benchmark.py --compare benchmark_results/<older>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmark_results")
+
+STUB_MODEL = "stub-model:latest"
+STUB_CONTEXT_LENGTH = 8192
+WORDS = ("local model prompt context token document project stream chat reply "
+         "history window cache latency throughput summary answer question").split()
+
+def lorem(words, seed=0):
+    """Deterministic filler text of roughly the given number of words"""
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+class StubOllamaClient:
+    """Synchronous stand-in for ollama.Client that answers instantly"""
+
+    def list(self):
+        return {"models": [{"name": STUB_MODEL, "size": 4 * 1024 ** 3, "digest": "stub",
+                            "modified_at": "2024-01-01T00:00:00"}]}
+
+    def ps(self):
+        return {"models": [{"name": STUB_MODEL, "size": 4 * 1024 ** 3}]}
+
+    def show(self, model):
+        return {"model_info": {"stub.context_length": STUB_CONTEXT_LENGTH}}
+
+    def generate(self, model, prompt="", **kwargs):
+        return {"response": "", "done": True}
+
+    def embed(self, model, input, **kwargs):
+        return {"embeddings": [[float(len(text) % 7), 1.0, 0.5] for text in input]}
+
+class StubAsyncClient:
+    """Asynchronous stand-in for ollama.AsyncClient that streams a canned reply.
+
+    token_delay (seconds) simulates generation speed; 0 measures pure app overhead.
+    """
+
+    def __init__(self, reply_tokens=32, token_delay=0.0):
+        self.reply_tokens = reply_tokens
+        self.token_delay = token_delay
+
+    async def chat(self, model, messages, stream=False, **kwargs):
+        prompt_chars = sum(len(message["content"]) for message in messages)
+
+        async def chunks():
+            for i in range(self.reply_tokens):
+                if self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+                yield {"message": {"role": "assistant", "content": f"{WORDS[i % len(WORDS)]} "}, "done": False}
+            yield {
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "prompt_eval_count": prompt_chars // 4,
+                "prompt_eval_duration": 0,
+                "eval_count": self.reply_tokens,
+                "eval_duration": int(self.reply_tokens * self.token_delay * 1e9),
+                "load_duration": 0,
+                "total_duration": int(self.reply_tokens * self.token_delay * 1e9)
+            }
+        return chunks()
+
+def import_app(workdir):
+    """Import app with every on-disk store redirected into workdir and Ollama stubbed out"""
+    os.chdir(workdir)
+    os.environ.setdefault("LOCALGPT_METRICS_PORT", "0")
+    os.environ.setdefault("LOCALGPT_PREFILL_ON_UPLOAD", "0")
+    os.environ.setdefault("LOCALGPT_PRELOAD_ON_SELECT", "0")
+    # Let concurrent turns overlap so the concurrency benchmark measures the client, not the queue
+    os.environ.setdefault("LOCALGPT_MODEL_CONCURRENCY", "64")
+    os.environ.setdefault("LOCALGPT_MAX_QUEUED_PER_SESSION", "1000")
+    os.environ.setdefault("LOCALGPT_MODEL_CATALOG_SNAPSHOT", os.path.join(workdir, "model_catalog.json"))
+    sys.path.insert(0, REPO_DIR)
+    import app
+
+    sync_client = StubOllamaClient()
+    app.get_ollama_client = lambda host=None: sync_client
+    app.get_async_client = lambda host=None: app._benchmark_async_client
+    app._benchmark_async_client = StubAsyncClient()
+    app.backend_pool.probe_all()
+    return app
+
+def timing_stats(samples):
+    """Summary statistics (milliseconds) for a list of durations in seconds"""
+    samples_ms = sorted(sample * 1000 for sample in samples)
+    return {
+        "runs": len(samples_ms),
+        "mean_ms": round(statistics.fmean(samples_ms), 4),
+        "median_ms": round(statistics.median(samples_ms), 4),
+        "min_ms": round(samples_ms[0], 4),
+        "p95_ms": round(samples_ms[min(len(samples_ms) - 1, int(0.95 * len(samples_ms)))], 4)
+    }
+
+def measure(fn, repeat, warmup=1):
+    """Run fn warmup + repeat times and return timing stats for the measured runs"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start_time)
+    return timing_stats(samples)
+
+def make_history(turns, words_per_message=60):
+    return [[lorem(words_per_message, seed=2 * i), lorem(words_per_message, seed=2 * i + 1)]
+            for i in range(turns)]
+
+def bench_chat(app, repeat):
+    """chat_wrapper overhead per turn as the history grows (instant stub replies)"""
+    app._benchmark_async_client = StubAsyncClient(reply_tokens=32)
+    results = []
+    for turns in (0, 10, 50, 200, 1000):
+        history = make_history(turns)
+
+        async def run_turn():
+            start_time = time.perf_counter()
+            first_yield = None
+            async for _ in app.chat_wrapper("What does the document say about caching?", history,
+                                            STUB_MODEL, "You are a helpful AI assistant.", None):
+                if first_yield is None:
+                    first_yield = time.perf_counter() - start_time
+            return first_yield, time.perf_counter() - start_time
+
+        async def run_all():
+            await run_turn()
+            return [await run_turn() for _ in range(repeat)]
+
+        samples = asyncio.run(run_all())
+        results.append({
+            "history_turns": turns,
+            "total": timing_stats([total for _, total in samples]),
+            "first_yield": timing_stats([first for first, _ in samples])
+        })
+    return results
+
+def bench_chat_concurrency(app, repeat):
+    """Wall time for N simultaneous turns against a stub generating 200 tokens/s"""
+    app._benchmark_async_client = StubAsyncClient(reply_tokens=20, token_delay=0.005)
+    history = make_history(5)
+    results = []
+    for users in (1, 4, 16, 64):
+        async def run_turn(user):
+            async for _ in app.chat_wrapper(f"Question from user {user}", history,
+                                            STUB_MODEL, "You are a helpful AI assistant.", None):
+                pass
+
+        async def run_batch():
+            start_time = time.perf_counter()
+            await asyncio.gather(*(run_turn(user) for user in range(users)))
+            return time.perf_counter() - start_time
+
+        samples = [asyncio.run(run_batch()) for _ in range(repeat)]
+        stats = timing_stats(samples)
+        stats["concurrent_turns"] = users
+        stats["turns_per_second"] = round(users / statistics.median(samples), 2)
+        results.append(stats)
+    return results
+
+def write_txt(path, words):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(lorem(words))
+
+def pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def write_pdf(path, pages, lines_per_page=40):
+    """Write a minimal multi-page PDF with one Helvetica text block per page"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    page_refs = []
+    for page in range(pages):
+        lines = [lorem(12, seed=page * lines_per_page + line) for line in range(lines_per_page)]
+        text = " T* ".join(f"({pdf_escape(line)}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 760 Td {text} ET".encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode('ascii')
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, 'wb') as f:
+        f.write(output)
+
+def write_docx(path, paragraphs):
+    import docx
+    document = docx.Document()
+    for i in range(paragraphs):
+        document.add_paragraph(lorem(80, seed=i))
+    document.save(path)
+
+def bench_files(app, repeat, workdir):
+    """process_file throughput for generated fixtures, with a cold and a warm extraction cache"""
+    fixtures_dir = os.path.join(workdir, "fixtures")
+    os.makedirs(fixtures_dir, exist_ok=True)
+    fixtures = []
+    for words in (10_000, 100_000, 1_000_000):
+        fixtures.append(("txt", words, lambda path, n=words: write_txt(path, n)))
+    for pages in (10, 100, 500):
+        fixtures.append(("pdf", pages, lambda path, n=pages: write_pdf(path, n)))
+    for paragraphs in (100, 1000, 5000):
+        fixtures.append(("docx", paragraphs, lambda path, n=paragraphs: write_docx(path, n)))
+
+    results = []
+    for kind, size, writer in fixtures:
+        path = os.path.join(fixtures_dir, f"fixture-{size}.{kind}")
+        writer(path)
+        file_bytes = os.path.getsize(path)
+
+        def clear_cache():
+            if os.path.isdir(app.extraction_cache.directory):
+                for filename in os.listdir(app.extraction_cache.directory):
+                    os.remove(os.path.join(app.extraction_cache.directory, filename))
+
+        cold = []
+        characters = 0
+        for _ in range(repeat):
+            clear_cache()
+            start_time = time.perf_counter()
+            characters = len(app.process_file(path) or "")
+            cold.append(time.perf_counter() - start_time)
+        warm = measure(lambda: app.process_file(path), repeat, warmup=0)
+        cold_stats = timing_stats(cold)
+        results.append({
+            "format": kind,
+            "size": size,
+            "file_bytes": file_bytes,
+            "characters": characters,
+            "cold": cold_stats,
+            "warm": warm,
+            "cold_mb_per_second": round(file_bytes / 1024 / 1024 / (cold_stats["median_ms"] / 1000), 2)
+        })
+    return results
+
+def bench_projects(app, repeat):
+    """save_chat_project / load_chat_project latency as projects grow"""
+    document = lorem(50_000)
+    results = []
+    for turns in (10, 100, 1000, 5000):
+        history = make_history(turns)
+        name = f"bench-{turns}"
+
+        # Full rewrite: a fresh project each time
+        counter = iter(range(1_000_000))
+        full = measure(lambda: app.save_chat_project(f"{name}-{next(counter)}", history,
+                                                     "You are a helpful AI assistant.", document), repeat)
+
+        # Incremental: one new turn appended to an existing project
+        app.save_chat_project(name, history, "You are a helpful AI assistant.", document)
+        growing = list(history)
+
+        def append_turn():
+            growing.append(["One more question?", "One more answer."])
+            app.save_chat_project(name, growing, "You are a helpful AI assistant.", document)
+        incremental = measure(append_turn, repeat, warmup=0)
+
+        def load():
+            # Cold load: the document is decompressed again, as on a fresh start
+            app.get_project_store().clear_document_cache()
+            _, _, _, file_cont = app.load_chat_project(name)
+            app.resolve_document(file_cont)
+        loaded = measure(load, repeat)
+
+        results.append({
+            "history_turns": turns,
+            "save_new": full,
+            "save_one_more_turn": incremental,
+            "load": loaded,
+            "database_bytes": os.path.getsize(app.PROJECTS_DB)
+        })
+    return results
+
+def bench_search(app, repeat):
+    """Model catalog search index build and query time over synthetic catalogs"""
+    categories = ["general", "coding", "vision", "embedding", "specialized", "new"]
+    rng = random.Random(0)
+    results = []
+    for size in (1_000, 10_000, 100_000):
+        catalog = [
+            [f"{rng.choice(WORDS)}-{i}:latest", rng.choice(categories), "4.1 GB",
+             lorem(20, seed=i), "Available", "", "Install"]
+            for i in range(size)
+        ]
+        build = measure(lambda: app.ModelSearchIndex(catalog), max(1, repeat // 2), warmup=0)
+        build.update({"catalog_size": size, "search": None, "category": None})
+        results.append(build)
+        index = app.ModelSearchIndex(catalog)
+        for search, category in (("", "coding"), ("cache", "All"), ("cache", "coding"),
+                                 ("ca", "All"), ("zzz-no-match", "All")):
+            stats = measure(lambda: index.search(search, category), repeat)
+            stats.update({"catalog_size": size, "search": search, "category": category})
+            results.append(stats)
+    return results
+
+BENCHMARKS = {
+    "chat": bench_chat,
+    "concurrency": bench_chat_concurrency,
+    "files": bench_files,
+    "projects": bench_projects,
+    "search": bench_search,
+}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare(previous_path, current):
+    """Print median changes between a previous results file and this run"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous.get('commit')} ({previous_path}):")
+
+    def medians(node, path=""):
+        if isinstance(node, dict):
+            if "median_ms" in node:
+                yield path, node["median_ms"]
+            for key, value in node.items():
+                yield from medians(value, f"{path}/{key}")
+        elif isinstance(node, list):
+            for i, value in enumerate(node):
+                yield from medians(value, f"{path}[{i}]")
+
+    old = dict(medians(previous["results"]))
+    for path, median in medians(current["results"]):
+        if path in old and old[path]:
+            change = (median - old[path]) / old[path]
+            print(f"  {path}: {old[path]:.3f} -> {median:.3f} ms ({change:+.0%})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run LocalGPT micro-benchmarks against a stub Ollama")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=5, help="measured runs per case")
+    parser.add_argument("--output", help="results file (default benchmark_results/<commit>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{git_commit() or 'nogit'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output = os.path.abspath(output)
+
+    with tempfile.TemporaryDirectory(prefix="localgpt-bench-") as workdir:
+        app = import_app(workdir)
+        results = {}
+        for name in args.only or BENCHMARKS:
+            print(f"Running {name}...")
+            start_time = time.perf_counter()
+            benchmark = BENCHMARKS[name]
+            if name == "files":
+                results[name] = benchmark(app, args.repeat, workdir)
+            else:
+                results[name] = benchmark(app, args.repeat)
+            print(f"  done in {time.perf_counter() - start_time:.1f}s")
+        os.chdir(REPO_DIR)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(args.compare, report)
+
+if __name__ == "__main__":
+    main()
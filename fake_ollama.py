@@ -0,0 +1,360 @@
+"""Fake Ollama server for load testing LocalGPT without a GPU.
+
+Implements the parts of the Ollama HTTP API the app uses (/api/tags, /api/ps,
+/api/show, /api/chat, /api/generate, /api/embed, /api/pull, /api/delete)
+with configurable speed, streaming and failure behaviour:
+
+    python fake_ollama.py --port 11435 --token-rate 30 --load-delay 3 --error-rate 0.02
+
+--chunk-jitter adds a random delay to every streamed token, and --no-stream
+models a backend (or proxy) that buffers the whole reply: streamed requests
+get all their chunks at once when generation finishes.
+
+Then point the app at it with LOCALGPT_OLLAMA_HOST=http://127.0.0.1:11435.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the model reads the prompt and writes a short answer about local inference "
+         "caching context windows and throughput under load").split()
+
+class FakeOllamaState:
+    """Settings and shared state (installed and loaded models) for the fake server"""
+
+    def __init__(self, models, token_rate, reply_tokens, load_delay, prompt_rate,
+                 error_rate, error_status, parallel, model_size_gb, chunk_jitter=0.0, buffered=False):
+        self.models = set(models)
+        self.token_rate = token_rate
+        self.chunk_jitter = chunk_jitter
+        self.buffered = buffered
+        self.reply_tokens = reply_tokens
+        self.load_delay = load_delay
+        self.prompt_rate = prompt_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.model_size = int(model_size_gb * 1024 ** 3)
+        self.loaded = {}
+        self.lock = threading.Lock()
+        # Like OLLAMA_NUM_PARALLEL: requests beyond this wait for a free slot
+        self.slots = threading.Semaphore(parallel)
+        self.requests = 0
+        self.errors = 0
+
+    def ensure_loaded(self, model):
+        """Seconds spent loading the model (0 if it was already resident)"""
+        with self.lock:
+            if model in self.loaded:
+                self.loaded[model] = time.time()
+                return 0.0
+        time.sleep(self.load_delay)
+        with self.lock:
+            self.loaded[model] = time.time()
+        return self.load_delay
+
+    def unload(self, model):
+        with self.lock:
+            self.loaded.pop(model, None)
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            failed = random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+def model_entry(state, name):
+    return {
+        "name": name,
+        "model": name,
+        "size": state.model_size,
+        "digest": f"fake-{abs(hash(name)) % 10 ** 12:012d}",
+        "modified_at": datetime.now(timezone.utc).isoformat(),
+        "details": {"family": "fake", "parameter_size": "7B", "quantization_level": "Q4_0"}
+    }
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_chunk(self, payload):
+        data = json.dumps(payload).encode('utf-8') + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        state = self.state
+        if self.path == "/api/tags":
+            self.send_json({"models": [model_entry(state, name) for name in sorted(state.models)]})
+        elif self.path == "/api/ps":
+            with state.lock:
+                loaded = sorted(state.loaded)
+            self.send_json({"models": [model_entry(state, name) for name in loaded]})
+        elif self.path == "/api/version":
+            self.send_json({"version": "0.0.0-fake"})
+        elif self.path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_DELETE(self):
+        if self.path != "/api/delete":
+            self.send_json({"error": "not found"}, 404)
+            return
+        name = self.read_json().get("model") or ""
+        with self.state.lock:
+            self.state.models.discard(name)
+            self.state.loaded.pop(name, None)
+        self.send_json({})
+
+    def do_POST(self):
+        state = self.state
+        payload = self.read_json()
+        model = payload.get("model") or payload.get("name") or ""
+        routes = {
+            "/api/chat": self.handle_generation,
+            "/api/generate": self.handle_generation,
+            "/api/show": self.handle_show,
+            "/api/embed": self.handle_embed,
+            "/api/pull": self.handle_pull,
+        }
+        route = routes.get(self.path)
+        if route is None:
+            self.send_json({"error": "not found"}, 404)
+            return
+        if self.path != "/api/show" and state.should_fail():
+            self.send_json({"error": "injected failure"}, state.error_status)
+            return
+        if self.path in ("/api/chat", "/api/generate", "/api/embed", "/api/show") and model not in state.models:
+            self.send_json({"error": f"model '{model}' not found"}, 404)
+            return
+        route(model, payload)
+
+    def handle_show(self, model, payload):
+        self.send_json({
+            "modelfile": "",
+            "details": {"family": "fake"},
+            "model_info": {"fake.context_length": 8192}
+        })
+
+    def handle_embed(self, model, payload):
+        inputs = payload.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        embeddings = []
+        for text in inputs:
+            rng = random.Random(text)
+            embeddings.append([rng.uniform(-1, 1) for _ in range(64)])
+        self.send_json({"model": model, "embeddings": embeddings})
+
+    def handle_generation(self, model, payload):
+        state = self.state
+        is_chat = self.path == "/api/chat"
+        if payload.get("keep_alive") in (0, "0", "0s") and not payload.get("messages") and not payload.get("prompt"):
+            state.unload(model)
+            self.send_json({"model": model, "done": True, "done_reason": "unload", "response": ""})
+            return
+
+        with state.slots:
+            start_time = time.perf_counter()
+            load_seconds = state.ensure_loaded(model)
+            if is_chat:
+                prompt = "".join(message.get("content") or "" for message in payload.get("messages") or [])
+            else:
+                prompt = payload.get("prompt") or ""
+            prompt_tokens = max(1, len(prompt) // 4)
+            prompt_seconds = prompt_tokens / state.prompt_rate if state.prompt_rate else 0.0
+            time.sleep(prompt_seconds)
+
+            # A bare load request (no prompt) just warms the model
+            reply_tokens = state.reply_tokens if (prompt or is_chat) else 0
+            num_predict = (payload.get("options") or {}).get("num_predict")
+            # Like Ollama, only a positive num_predict limits the reply
+            if num_predict is not None and num_predict > 0:
+                reply_tokens = min(reply_tokens, num_predict)
+
+            def piece(i):
+                return WORDS[i % len(WORDS)] + " "
+
+            def final(text):
+                total = time.perf_counter() - start_time
+                chunk = {
+                    "model": model,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "done": True,
+                    "done_reason": "stop",
+                    "total_duration": int(total * 1e9),
+                    "load_duration": int(load_seconds * 1e9),
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(prompt_seconds * 1e9),
+                    "eval_count": reply_tokens,
+                    "eval_duration": int(max(0.0, total - load_seconds - prompt_seconds) * 1e9)
+                }
+                if is_chat:
+                    chunk["message"] = {"role": "assistant", "content": text}
+                else:
+                    chunk["response"] = text
+                return chunk
+
+            delay = 1.0 / state.token_rate if state.token_rate else 0.0
+
+            def token_delay():
+                return delay + (random.uniform(0.0, state.chunk_jitter) if state.chunk_jitter else 0.0)
+
+            def chunk_for(i):
+                chunk = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": False}
+                if is_chat:
+                    chunk["message"] = {"role": "assistant", "content": piece(i)}
+                else:
+                    chunk["response"] = piece(i)
+                return chunk
+
+            if payload.get("stream", True) and state.buffered:
+                # Generate everything first, then flush it as one burst of chunks
+                chunks = []
+                for i in range(reply_tokens):
+                    time.sleep(token_delay())
+                    chunks.append(chunk_for(i))
+                try:
+                    self.start_stream()
+                    for chunk in chunks:
+                        self.send_chunk(chunk)
+                    self.send_chunk(final(""))
+                    self.end_stream()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            elif payload.get("stream", True):
+                self.start_stream()
+                try:
+                    for i in range(reply_tokens):
+                        time.sleep(token_delay())
+                        self.send_chunk(chunk_for(i))
+                    self.send_chunk(final(""))
+                    self.end_stream()
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client went away mid-stream; the slot is released as we leave
+                    pass
+            else:
+                time.sleep(sum(token_delay() for _ in range(reply_tokens)))
+                self.send_json(final("".join(piece(i) for i in range(reply_tokens))))
+
+    def handle_pull(self, model, payload):
+        state = self.state
+        total = state.model_size
+        steps = 20
+        self.start_stream()
+        try:
+            self.send_chunk({"status": "pulling manifest"})
+            for step in range(1, steps + 1):
+                time.sleep(0.05)
+                self.send_chunk({"status": "downloading", "digest": "sha256:fake",
+                                 "total": total, "completed": total * step // steps})
+            with state.lock:
+                state.models.add(model)
+            self.send_chunk({"status": "success"})
+            self.end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def make_server(host="127.0.0.1", port=11435, **settings):
+    """Build (but don't start) a fake Ollama server; settings go to FakeOllamaState"""
+    state = FakeOllamaState(**settings)
+    handler = type("BoundFakeOllamaHandler", (FakeOllamaHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def add_arguments(parser):
+    parser.add_argument("--models", nargs="+", default=["llama2:latest", "mistral:latest", "nomic-embed-text:latest"],
+                        help="models reported as installed")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="generated tokens per second per request (0 = instant)")
+    parser.add_argument("--reply-tokens", type=int, default=64, help="tokens in every reply")
+    parser.add_argument("--prompt-rate", type=float, default=2000.0, help="prompt tokens evaluated per second (0 = instant)")
+    parser.add_argument("--load-delay", type=float, default=2.0, help="seconds to load a model that isn't resident")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status used for injected errors")
+    parser.add_argument("--parallel", type=int, default=1, help="requests processed at once (like OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--model-size-gb", type=float, default=4.0, help="reported size of every model")
+    parser.add_argument("--chunk-jitter", type=float, default=0.0,
+                        help="extra random delay of up to this many seconds per generated token")
+    parser.add_argument("--no-stream", dest="buffered", action="store_true",
+                        help="buffer whole replies, sending streamed chunks all at once at the end")
+
+def settings_from_args(args):
+    return {
+        "models": args.models,
+        "token_rate": args.token_rate,
+        "reply_tokens": args.reply_tokens,
+        "prompt_rate": args.prompt_rate,
+        "load_delay": args.load_delay,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "parallel": args.parallel,
+        "model_size_gb": args.model_size_gb,
+        "chunk_jitter": args.chunk_jitter,
+        "buffered": args.buffered,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, **settings_from_args(args))
+    print(f"Fake Ollama listening on http://{args.host}:{args.port} "
+          f"({args.token_rate:g} tok/s, load {args.load_delay:g}s, errors {args.error_rate:.0%}"
+          f"{', buffered' if args.buffered else ''})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        state = server.RequestHandlerClass.state
+        print(f"Served {state.requests} requests, {state.errors} injected errors")
+
+if __name__ == "__main__":
+    main()
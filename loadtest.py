@@ -0,0 +1,247 @@
+"""Multi-user load test for a running LocalGPT instance.
+
+Simulates N concurrent browser sessions, each running a scripted
+conversation through the app's chat endpoint with gradio_client, and reports
+throughput, queue wait and latency percentiles. Pass several user counts to
+find where latency starts to collapse:
+
+    python loadtest.py --launch --users 1 4 16 32
+
+--launch starts a fake Ollama server (see fake_ollama.py) and the app itself
+on free ports; without it, --url must point at an app that is already
+running (against a real or fake Ollama).
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_ollama
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SCRIPT = [
+    "Hi! Can you explain what a context window is?",
+    "How does that affect long conversations?",
+    "Give me three tips for keeping prompts short.",
+    "Summarise what we talked about in one sentence.",
+]
+
+QUEUE_PLACEHOLDER = "⏳"
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_url(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2)
+            return
+        except Exception:
+            time.sleep(0.5)
+    raise TimeoutError(f"{url} did not come up within {timeout:.0f}s")
+
+def load_script(path):
+    """Prompts for one conversation: a JSON list of strings or a JSON-lines file of {"prompt": ...}"""
+    if not path:
+        return DEFAULT_SCRIPT
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        prompts = json.loads(text)
+    except ValueError:
+        prompts = [json.loads(line)["prompt"] for line in text.splitlines() if line.strip()]
+    return [str(prompt) for prompt in prompts]
+
+def read_history(value):
+    """Chatbot output from gradio_client: either the history itself or a JSON file holding it"""
+    if isinstance(value, str) and os.path.exists(value):
+        with open(value, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return value or []
+
+def run_turn(client, message, history, model, system):
+    """Send one chat turn and time it; returns (new_history, measurement)"""
+    start_time = time.perf_counter()
+    queue_wait = 0.0
+    first_token = None
+    reply = ""
+    job = client.submit(message, history, model, system, False, 0.7, 0, False, False, api_name="/chat")
+    for output in job:
+        now = time.perf_counter() - start_time
+        new_history = read_history(output[1])
+        if not new_history:
+            continue
+        reply = new_history[-1][1] or ""
+        if reply.startswith(QUEUE_PLACEHOLDER):
+            queue_wait = now
+        elif reply and first_token is None:
+            first_token = now
+    outputs = job.outputs()
+    if outputs:
+        new_history = read_history(outputs[-1][1])
+        reply = new_history[-1][1] if new_history else ""
+    else:
+        new_history = history
+    total = time.perf_counter() - start_time
+    return new_history, {
+        "queue_wait": queue_wait,
+        "time_to_first_token": first_token,
+        "total": total,
+        "reply_words": len(reply.split()),
+        "error": not reply or reply.startswith("Error:")
+    }
+
+def run_user(url, user, script, model, system, turns, think_time):
+    """One simulated browser session working through the script"""
+    from gradio_client import Client
+    client = Client(url, verbose=False)
+    history = []
+    measurements = []
+    for i in range(turns):
+        message = script[i % len(script)]
+        try:
+            history, measurement = run_turn(client, message, history, model, system)
+        except Exception as e:
+            measurement = {"queue_wait": None, "time_to_first_token": None, "total": None,
+                           "reply_words": 0, "error": True, "exception": str(e)}
+        measurement["user"] = user
+        measurements.append(measurement)
+        if think_time:
+            time.sleep(think_time)
+    return measurements
+
+def summarise(users, measurements, wall_time):
+    ok = [m for m in measurements if not m["error"]]
+
+    def stats(key):
+        values = [m[key] for m in ok if m[key] is not None]
+        return {
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "max": max(values) if values else None
+        }
+
+    return {
+        "users": users,
+        "turns": len(measurements),
+        "errors": len(measurements) - len(ok),
+        "wall_time": wall_time,
+        "turns_per_second": len(ok) / wall_time if wall_time else None,
+        "words_per_second": sum(m["reply_words"] for m in ok) / wall_time if wall_time else None,
+        "queue_wait": stats("queue_wait"),
+        "time_to_first_token": stats("time_to_first_token"),
+        "latency": stats("total")
+    }
+
+def run_level(url, users, script, model, system, turns, think_time):
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        futures = [pool.submit(run_user, url, user, script, model, system, turns, think_time)
+                   for user in range(users)]
+        measurements = [m for future in futures for m in future.result()]
+    return summarise(users, measurements, time.perf_counter() - start_time), measurements
+
+def format_seconds(value):
+    return f"{value:.2f}s" if value is not None else "-"
+
+def print_report(summaries):
+    print()
+    print(f"{'Users':>5} {'Turns':>6} {'Errors':>6} {'Turns/s':>8} "
+          f"{'Wait p50':>9} {'Wait p95':>9} {'TTFT p50':>9} {'TTFT p95':>9} {'Lat p50':>9} {'Lat p95':>9} {'Lat p99':>9}")
+    for s in summaries:
+        print(f"{s['users']:>5} {s['turns']:>6} {s['errors']:>6} {s['turns_per_second'] or 0:>8.2f} "
+              f"{format_seconds(s['queue_wait']['p50']):>9} {format_seconds(s['queue_wait']['p95']):>9} "
+              f"{format_seconds(s['time_to_first_token']['p50']):>9} {format_seconds(s['time_to_first_token']['p95']):>9} "
+              f"{format_seconds(s['latency']['p50']):>9} {format_seconds(s['latency']['p95']):>9} "
+              f"{format_seconds(s['latency']['p99']):>9}")
+
+def launch_stack(args):
+    """Start a fake Ollama in-process and the app in a subprocess; returns (url, app_process)"""
+    ollama_port = free_port()
+    server = fake_ollama.make_server("127.0.0.1", ollama_port, **fake_ollama.settings_from_args(args))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Fake Ollama on http://127.0.0.1:{ollama_port}")
+
+    app_port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "LOCALGPT_OLLAMA_HOST": f"http://127.0.0.1:{ollama_port}",
+        "GRADIO_SERVER_NAME": "127.0.0.1",
+        "GRADIO_SERVER_PORT": str(app_port),
+        "GRADIO_ANALYTICS_ENABLED": "False",
+        "LOCALGPT_METRICS_PORT": "0",
+    })
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "app.py")], cwd=args.workdir or REPO_DIR,
+                               env=env, stdout=subprocess.DEVNULL if not args.app_output else None,
+                               stderr=subprocess.STDOUT if not args.app_output else None)
+    url = f"http://127.0.0.1:{app_port}/"
+    try:
+        wait_for_url(url, args.startup_timeout)
+    except Exception:
+        process.terminate()
+        raise
+    print(f"LocalGPT on {url}")
+    return url, process
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test LocalGPT with simulated concurrent users")
+    parser.add_argument("--url", default="http://127.0.0.1:7860/", help="running app to test (ignored with --launch)")
+    parser.add_argument("--launch", action="store_true", help="start a fake Ollama and the app automatically")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16], help="concurrent users; several values run a sweep")
+    parser.add_argument("--turns", type=int, default=4, help="turns per user")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds each user waits between turns")
+    parser.add_argument("--model", default="llama2:latest")
+    parser.add_argument("--system", default="You are a helpful AI assistant.")
+    parser.add_argument("--script", help="JSON list of prompts, or JSON lines with a prompt field")
+    parser.add_argument("--output", help="write summaries and raw measurements to this JSON file")
+    parser.add_argument("--workdir", help="directory the launched app runs in (projects, caches)")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--app-output", action="store_true", help="show the launched app's console output")
+    fake_ollama.add_arguments(parser.add_argument_group("fake Ollama (with --launch)"))
+    args = parser.parse_args()
+
+    script = load_script(args.script)
+    process = None
+    url = args.url
+    if args.launch:
+        url, process = launch_stack(args)
+    try:
+        summaries = []
+        raw = {}
+        for users in args.users:
+            print(f"Running {users} user(s) x {args.turns} turn(s)...")
+            summary, measurements = run_level(url, users, script, args.model, args.system,
+                                              args.turns, args.think_time)
+            summaries.append(summary)
+            raw[str(users)] = measurements
+        print_report(summaries)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({"url": url, "model": args.model, "summaries": summaries, "measurements": raw}, f, indent=2)
+            print(f"\nResults written to {args.output}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+if __name__ == "__main__":
+    main()
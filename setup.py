@@ -4,15 +4,19 @@ setup(
     name="localgpt",
     version="0.1",
     packages=find_packages(),
+    py_modules=['app'],
     install_requires=[
         'gradio',
         'ollama',
+        'numpy',
+        'httpx',
         'python-docx',
         'PyPDF2',
     ],
     entry_points={
         'console_scripts': [
             'localgpt=app:main',
+            'localgpt-batch=app:batch_main',
         ],
     },
 )
@@ -0,0 +1,96 @@
+"""Concurrent chat turns share one pooled AsyncClient and overlap on the event loop.
+
+Runs real chat_wrapper turns against fake_ollama.py over HTTP, with the app's
+own get_async_client (nothing is stubbed), and checks that N turns gathered
+together take far less than N times as long as one turn.
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("ollama")
+pytest.importorskip("httpx")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fake_ollama
+
+MODEL = "llama2:latest"
+TURNS = 8
+# 20 tokens at 40 tokens/s: every turn spends about half a second generating
+REPLY_TOKENS = 20
+TOKEN_RATE = 40.0
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    port = free_port()
+    server = fake_ollama.make_server(
+        "127.0.0.1", port, models=[MODEL], token_rate=TOKEN_RATE, reply_tokens=REPLY_TOKENS,
+        prompt_rate=0.0, load_delay=0.0, error_rate=0.0, error_status=500,
+        parallel=TURNS, model_size_gb=1.0
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    workdir = tmp_path_factory.mktemp("localgpt")
+    previous_dir = os.getcwd()
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv("LOCALGPT_OLLAMA_HOST", f"http://127.0.0.1:{port}")
+        env.delenv("LOCALGPT_OLLAMA_HOSTS", raising=False)
+        env.setenv("LOCALGPT_METRICS_PORT", "0")
+        env.setenv("LOCALGPT_PREFILL_ON_UPLOAD", "0")
+        env.setenv("LOCALGPT_PRELOAD_ON_SELECT", "0")
+        # Let every turn hold a slot at once so the test measures the client, not the queue
+        env.setenv("LOCALGPT_MODEL_CONCURRENCY", str(TURNS))
+        env.setenv("LOCALGPT_MAX_QUEUED_PER_SESSION", str(TURNS * 4))
+        env.setenv("LOCALGPT_MODEL_CATALOG_SNAPSHOT", str(workdir / "model_catalog.json"))
+        os.chdir(workdir)
+        try:
+            import app as app_module
+            app_module.backend_pool.probe_all()
+            yield app_module
+        finally:
+            os.chdir(previous_dir)
+            server.shutdown()
+
+async def run_turn(app, message):
+    """Drive one chat_wrapper turn to completion and return the reply"""
+    history = []
+    async for _, history, _ in app.chat_wrapper(message, [], MODEL, "", "", use_retrieval=False, doc_index=None):
+        pass
+    return history[-1][1]
+
+def test_turns_overlap_on_pooled_client(app):
+    async def scenario():
+        # The first turn also warms the model-info lookups, so time the second
+        await run_turn(app, "warm up")
+        start_time = time.perf_counter()
+        reply = await run_turn(app, "single")
+        single = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        replies = await asyncio.gather(*(run_turn(app, f"turn {i}") for i in range(TURNS)))
+        wall = time.perf_counter() - start_time
+
+        clients = app._async_clients[asyncio.get_running_loop()]
+        return reply, single, replies, wall, list(clients)
+
+    reply, single, replies, wall, hosts = asyncio.run(scenario())
+
+    assert reply and not reply.startswith("Error")
+    assert all(r and not r.startswith("Error") for r in replies)
+    # One pooled client served every turn on this loop
+    assert hosts == [app.OLLAMA_HOST]
+    assert single >= REPLY_TOKENS / TOKEN_RATE * 0.8
+    assert wall < single * TURNS / 2, f"{TURNS} turns took {wall:.2f}s; one took {single:.2f}s"
@@ -0,0 +1,87 @@
+"""ProjectStore: documents held by DocumentRef, and search index ids across VACUUM and migration."""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+DOCUMENT = "Quarterly report. " * 500
+
+@pytest.fixture
+def app():
+    import app as app_module
+    return app_module
+
+@pytest.fixture
+def store(app, tmp_path):
+    return app.ProjectStore(path=str(tmp_path / "projects.db"), legacy_dir=str(tmp_path / "legacy"))
+
+def test_save_as_after_deleting_every_project_with_the_document(app, store):
+    history = [["What changed?", "Revenue went up."]]
+    store.save("A", history, "", DOCUMENT)
+    store.save("B", history, "", DOCUMENT)
+
+    # A session loads A, which leaves only a reference to the document in its state
+    ref = app.DocumentRef(store.load("A")["file_hash"])
+    store.delete("A")
+    store.delete("B")
+    assert store._conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 0
+
+    # ...and later saves the same session under a new name
+    store.save("C", history, "", ref)
+    saved = store.load("C")
+    assert saved["file_hash"] == ref.file_hash
+    store.clear_document_cache()
+    assert store.load_document(saved["file_hash"]) == DOCUMENT
+
+def test_ref_resaved_while_blob_exists_only_adds_a_reference(app, store):
+    store.save("A", [], "", DOCUMENT)
+    ref = app.DocumentRef(store.load("A")["file_hash"])
+    store.save("B", [], "", ref)
+    assert store._conn.execute("SELECT refcount FROM blobs").fetchall() == [(2,)]
+    store.delete("A")
+    store.clear_document_cache()
+    assert store.load_document(store.load("B")["file_hash"]) == DOCUMENT
+
+def search_hits(store, query):
+    return [(hit["project"], hit["position"]) for hit in store.search(query)]
+
+def test_search_index_survives_vacuum(store):
+    store.save("old", [[f"filler {i}", "text"] for i in range(50)], "", "")
+    store.save("notes", [["first zebra", "a"], ["second giraffe", "b"]], "", "")
+    store.delete("old")
+    # VACUUM renumbers implicit rowids; the index is keyed on declared ids, which it keeps
+    store._conn.execute("VACUUM")
+    assert search_hits(store, "giraffe") == [("notes", 1)]
+
+    store.save("notes", [["first zebra", "a"], ["second okapi", "b"]], "", "")
+    assert search_hits(store, "giraffe") == []
+    assert search_hits(store, "okapi") == [("notes", 1)]
+    assert search_hits(store, "zebra") == [("notes", 0)]
+
+def test_legacy_tables_get_ids_matching_their_rowids(app, tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE projects (name TEXT PRIMARY KEY, timestamp TEXT NOT NULL,
+                               system_instruction TEXT NOT NULL DEFAULT '',
+                               file_content TEXT NOT NULL DEFAULT '', file_hash TEXT NOT NULL DEFAULT '',
+                               turn_count INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE messages (project TEXT NOT NULL, position INTEGER NOT NULL, turn_hash TEXT NOT NULL,
+                               user_message TEXT, assistant_message TEXT, PRIMARY KEY (project, position));
+        INSERT INTO projects (name, timestamp, system_instruction) VALUES ('p', '2024-01-01 00:00:00', 'be brief');
+        INSERT INTO messages VALUES ('p', 0, 'h0', 'hello walrus', 'hi');
+        INSERT INTO messages VALUES ('p', 1, 'h1', 'bye', 'farewell');
+    """)
+    rowids = conn.execute("SELECT rowid FROM messages ORDER BY position").fetchall()
+    conn.close()
+
+    store = app.ProjectStore(path=path, legacy_dir=str(tmp_path / "legacy"))
+    assert store._conn.execute("SELECT id FROM messages ORDER BY position").fetchall() == rowids
+    assert store.load("p")["history"] == [["hello walrus", "hi"], ["bye", "farewell"]]
+    assert search_hits(store, "walrus") == [("p", 0)]
+    assert search_hits(store, "brief") == [("p", -1)]